@@ -0,0 +1,94 @@
+import hashlib
+import os
+import pathlib
+import pickle
+import tempfile
+from collections import OrderedDict
+from typing import Callable, Hashable, Any
+
+
+class CompilationCache:
+    """
+    Class representing bounded LRU cache of compiled artifacts with hit and miss counters
+    and optional on-disk tier keeping pickled artifacts between runs.
+    Cached values are shared between callers and must not be mutated
+    """
+    def __init__(self, maxsize: int = 128, cache_dir=None):
+        """
+        :param maxsize: Maximum number of artifacts kept in memory
+        :param cache_dir: (optional) directory of the on-disk tier, artifacts are kept only in memory by default
+        """
+        self.maxsize = maxsize
+        self.cache_dir = pathlib.Path(cache_dir) if cache_dir is not None else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+
+    def get(self, key: Hashable, compile_value: Callable[[], Any]) -> Any:
+        """
+        Gets artifact by key: from memory, then from disk, compiling and storing it on a miss
+        :param key: Key of the artifact, its repr addresses the artifact on disk
+        :param compile_value: Function compiling the artifact
+        :return: cached or compiled artifact
+        """
+        if key in self._values:
+            self.hits += 1
+            self._values.move_to_end(key)
+            return self._values[key]
+
+        value = self._load(key)
+        if value is not None:
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            value = compile_value()
+            self._store(key, value)
+
+        self._values[key] = value
+        if len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+        return value
+
+    def clear(self):
+        """
+        Clears the in-memory tier and counters, the on-disk tier is kept
+        """
+        self._values.clear()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __repr__(self):
+        return (
+            f"CompilationCache({len(self)}/{self.maxsize} entries, "
+            f"{self.hits} hits, {self.disk_hits} disk hits, {self.misses} misses)"
+        )
+
+    def _get_file(self, key: Hashable) -> pathlib.Path:
+        return self.cache_dir / f"{hashlib.sha256(repr(key).encode()).hexdigest()}.pickle"
+
+    def _load(self, key: Hashable):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._get_file(key), "rb") as file:
+                stored_key, value = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError):
+            return None
+        return value if stored_key == key else None
+
+    def _store(self, key: Hashable, value):
+        if self.cache_dir is None:
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        file_descriptor, tmp_file = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(file_descriptor, "wb") as file:
+            pickle.dump((key, value), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, self._get_file(key))
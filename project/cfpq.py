@@ -1,187 +1,860 @@
-from collections import defaultdict
-from typing import Set, Tuple
+import copy
+import heapq
+import itertools
+from collections import defaultdict, deque
+from typing import Set, Tuple, Union, Dict, Iterable, List
 
 import networkx as nx
 import numpy as np
 import scipy.sparse as sp
-from pyformlang.cfg import CFG, Terminal, Variable
+from pyformlang.cfg import CFG, Variable
+from pyformlang.finite_automaton import Symbol, State
 
-from project.context_free_grammar_util import cfg_to_weak_cnf, get_cfg_from_file
+from project.context_free_grammar_util import get_grammar_index_from_file, GrammarIndex, get_grammar_index, \
+    cfg_to_rsm
 from project.g_util import load_graph
+from project.matrix_util import IterationStatistics, AdjacencyMatrix, intersect_adjacency_matrices, \
+    transitive_closure, resize_matrix
+from project.result_util import NodePairs
+from project.sparse_backend import SparseBackend, get_backend
 
 
 def cfpq_matrix_from_file(graph: str, cfg: str) -> Set:
     graph_as_MultiDiGrpah = load_graph(graph)
-    cfg_as_cfg = get_cfg_from_file(cfg)
-    return cfpq(graph_as_MultiDiGrpah, cfg_as_cfg, "matrix")
+    grammar_index = get_grammar_index_from_file(cfg)
+    return cfpq(graph_as_MultiDiGrpah, grammar_index, "matrix")
 
 
 def cfpq_hellings_from_file(graph: str, cfg: str) -> Set:
     graph_as_MultiDiGrpah = load_graph(graph)
-    cfg_as_cfg = get_cfg_from_file(cfg)
-    return cfpq(graph_as_MultiDiGrpah, cfg_as_cfg, "hellings")
+    grammar_index = get_grammar_index_from_file(cfg)
+    return cfpq(graph_as_MultiDiGrpah, grammar_index, "hellings")
 
 
-def cfpq(graph: nx.MultiDiGraph, cfg: CFG, algo: str = "hellings",
-    start_nodes: Set = None, final_nodes: Set = None, start_symbol: Variable = Variable("S")
-) -> Set:
+def cfpq(graph: nx.MultiDiGraph, cfg: Union[CFG, GrammarIndex], algo: str = "hellings",
+    start_nodes: Set = None, final_nodes: Set = None, start_symbol: Variable = Variable("S"),
+    sparse_result: bool = False, backend: Union[str, SparseBackend] = None
+) -> Union[Set, NodePairs]:
     """
     Executes query on graph with Hellings algorithm
-    :param graph: Graph as MultiDiGraph
-    :param cfg: CFG
+    :param graph: Graph as MultiDiGraph or LabeledGraph
+    :param cfg: CFG or GrammarIndex built from it, index must have the same start symbol
     :param algo: Algorithm to run cfpq
     :param start_nodes: Set of start nodes
     :param final_nodes: Set of final nodes
     :param start_symbol: Start symbol, defaults to "S"
+    :param sparse_result: return NodePairs backed by sparse matrix instead of Python set
+    :param backend: (optional) SparseBackend or its name running matrix algorithm, scipy by default
     :return: Pairs of vertices that have path between them with given constraints from graph
     """
-    cfg._start_symbol = start_symbol
+    _set_start_symbol(cfg, start_symbol)
 
-    if start_nodes is None:
-        start_nodes = graph.nodes
-    if final_nodes is None:
-        final_nodes = graph.nodes
-
-    result = set()
     if (algo == "hellings"):
-        algo_result = hellings_(cfg, graph)
+        algo_result = hellings_(cfg, graph, start_nodes, final_nodes, start_symbol)
     elif (algo == "matrix"):
-        algo_result = matrix_(cfg, graph)
+        result = NodePairs(*matrix_reachability(
+            cfg, graph, start_nodes, final_nodes, start_symbol, backend=backend
+        ))
+        return result if sparse_result else result.to_set()
+    elif (algo == "tensor"):
+        result = NodePairs(*tensor_reachability(cfg, graph, start_nodes, final_nodes, start_symbol))
+        return result if sparse_result else result.to_set()
+    elif (algo == "gll"):
+        algo_result = gll_(cfg, graph, start_nodes, final_nodes, start_symbol)
     else:
         raise Exception("Not supported algorithm")
 
-    for u, var_1, v in algo_result:
-        if start_symbol == var_1 and u in start_nodes and v in final_nodes:
-            result.add((u, v))
+    result = {(u, v) for u, _, v in algo_result}
+    if sparse_result:
+        return NodePairs.from_pairs(result, np.fromiter(graph.nodes, dtype=object, count=graph.number_of_nodes()))
     return result
 
 
-def hellings_(cfg: CFG, graph: nx.MultiDiGraph) -> Set[Tuple]:
+def hellings_(
+        cfg: Union[CFG, GrammarIndex], graph: nx.MultiDiGraph, start_nodes: Iterable = None,
+        final_nodes: Iterable = None, start_symbol: Variable = None
+) -> Set[Tuple]:
     """
     Calculate reachability between all pirs of vertices with Hellings algorithm on given CFG and graph
-    :param cfg: CFG
+    :param cfg: CFG or GrammarIndex built from it
     :param graph: Graph
+    :param start_nodes: (optional) only triplets starting in these nodes are returned
+    :param final_nodes: (optional) only triplets ending in these nodes are returned
+    :param start_symbol: (optional) only triplets of this variable are returned, all variables by default
     :return: triplets (vertex, variable, vertex) Vertex - NonTerminal - Vertex
     """
     node_count = graph.number_of_nodes()
     if node_count == 0:
         return set()
 
-    wcnf = cfg_to_weak_cnf(cfg)
-    var_to_var_dict = defaultdict(set)
+    index = get_grammar_index(cfg)
     result = set()
-    queue = []
+    queue = deque()
+    incoming = defaultdict(set)
+    outgoing = defaultdict(set)
+
+    def add(triplet):
+        if triplet not in result:
+            u, var, v = triplet
+            result.add(triplet)
+            incoming[(v, var)].add(u)
+            outgoing[(u, var)].add(v)
+            queue.append(triplet)
 
-    for productions in wcnf.productions:
-        terminal_to_variable = defaultdict(set)
-        eps = set()
-        l = len(productions.body)
-        if l == 0:
-            eps.add(productions.head)
-        elif l == 1:
-            terminal_to_variable[productions.head].add(productions.body[0])
-        elif l == 2:
-            var_to_var_dict[productions.head].add((productions.body[0], productions.body[1]))
-        for node in graph.nodes:
-            for var in eps:
-                triplet = (node, var, node)
-                result.add(triplet)
-                queue.append(triplet)
-        for i, j, label in graph.edges(data="label"):
-            for n, terms in terminal_to_variable.items():
-                if Terminal(label) in terms:
-                    triplet = (i, n, j)
-                    result.add(triplet)
-                    queue.append(triplet)
+    for node in graph.nodes:
+        for var in index.eps_heads:
+            add((node, var, node))
+    for i, j, label in graph.edges(data="label"):
+        for var in index.terminal_to_heads.get(label, ()):
+            add((i, var, j))
 
     while len(queue) != 0:
-        u_1, var_1, v_1 = queue.pop(0)
-        diff = set()
-
-        for u_2, var_2, v_2 in result:
-            if v_2 == u_1:
-                for node_count, var_to_var in var_to_var_dict.items():
-                    triplet = (u_2, node_count, v_1)
-                    if (var_2, var_1) in var_to_var and triplet not in result:
-                        diff.add(triplet)
-                        queue.append(triplet)
-
-            if v_1 == u_2:
-                for node_count, var_to_var in var_to_var_dict.items():
-                    triplet = (u_1, node_count, v_2)
-                    if (var_1, var_2) in var_to_var and triplet not in result:
-                        diff.add(triplet)
-                        queue.append(triplet)
-
-        result = result.union(diff)
+        u_1, var_1, v_1 = queue.popleft()
 
-    return result
+        for var_2, heads in index.right_to_left.get(var_1, ()):
+            for u_2 in tuple(incoming[(u_1, var_2)]):
+                for head in heads:
+                    add((u_2, head, v_1))
+
+        for var_2, heads in index.left_to_right.get(var_1, ()):
+            for v_2 in tuple(outgoing[(v_1, var_2)]):
+                for head in heads:
+                    add((u_1, head, v_2))
+
+    if start_nodes is None and final_nodes is None and start_symbol is None:
+        return result
+    start_nodes = _get_node_set(graph, start_nodes)
+    final_nodes = _get_node_set(graph, final_nodes)
+    return {
+        (u, var, v) for u, var, v in result
+        if (start_symbol is None or var == start_symbol) and u in start_nodes and v in final_nodes
+    }
 
 
-def matrix_(cfg: CFG, graph: nx.MultiDiGraph) -> Set[Tuple]:
+def matrix_(
+        cfg: Union[CFG, GrammarIndex], graph: nx.MultiDiGraph, statistics: IterationStatistics = None,
+        backend: Union[str, SparseBackend] = None
+) -> Set[Tuple]:
     """
     Calculate reachability between all pirs of vertices with Matrix algorithm on given CFG and graph
-    :param cfg: CFG
+    :param cfg: CFG or GrammarIndex built from it
     :param graph: Graph
+    :param statistics: (optional) collects number of rounds and entries discovered per round
+    :param backend: (optional) SparseBackend or its name running the products, scipy by default
     :return: triplets (vertex, variable, vertex) Vertex - NonTerminal - Vertex
     """
+    if graph.number_of_nodes() == 0:
+        return set()
+
+    graph_matrix, matrices = _matrix_variables(cfg, graph, statistics, backend)
+    return _matrices_to_triplets(matrices, graph_matrix)
+
+
+def matrix_reachability(
+        cfg: Union[CFG, GrammarIndex], graph: nx.MultiDiGraph, start_nodes: Iterable = None,
+        final_nodes: Iterable = None, start_symbol: Variable = Variable("S"), statistics: IterationStatistics = None,
+        backend: Union[str, SparseBackend] = None
+) -> Tuple[sp.csr_matrix, np.ndarray]:
+    """
+    Calculate reachability for start symbol with Matrix algorithm, without building triplets for all variables
+    :param cfg: CFG or GrammarIndex built from it
+    :param graph: Graph
+    :param start_nodes: Set of start nodes, all nodes by default
+    :param final_nodes: Set of final nodes, all nodes by default
+    :param start_symbol: Start symbol, defaults to "S"
+    :param statistics: (optional) collects number of rounds and entries discovered per round
+    :param backend: (optional) SparseBackend or its name running the products, scipy by default
+    :return: boolean matrix of start symbol masked by start (rows) and final (columns) nodes,
+    and graph nodes in matrix index order
+    """
+    _set_start_symbol(cfg, start_symbol)
+    graph_matrix, matrices = _matrix_variables(cfg, graph, statistics, backend)
+    return _mask_matrix(matrices.get(start_symbol), graph_matrix, start_nodes, final_nodes)
+
+
+def _matrix_variables(
+        cfg: Union[CFG, GrammarIndex], graph: nx.MultiDiGraph, statistics: IterationStatistics = None,
+        backend: Union[str, SparseBackend] = None
+) -> Tuple[AdjacencyMatrix, Dict[Variable, sp.csr_matrix]]:
+    """
+    Helper function running Matrix algorithm
+    :return: graph AdjacencyMatrix and variable -> boolean matrix
+    """
+    index = get_grammar_index(cfg)
+    graph_matrix = AdjacencyMatrix.from_graph(graph)
+    matrices = _get_initial_matrices(index, graph_matrix)
+    return graph_matrix, _matrix_fixpoint(index, matrices, statistics=statistics, backend=backend)
+
+
+def tensor_(
+        cfg: Union[CFG, GrammarIndex], graph: nx.MultiDiGraph, statistics: IterationStatistics = None
+) -> Set[Tuple]:
+    """
+    Calculate reachability between all pirs of vertices with Tensor algorithm on given CFG and graph
+    :param cfg: CFG or GrammarIndex built from it
+    :param graph: Graph
+    :param statistics: (optional) collects number of rounds and nonterminal edges added per round
+    :return: triplets (vertex, variable, vertex) Vertex - NonTerminal - Vertex
+    """
+    if graph.number_of_nodes() == 0:
+        return set()
+
+    graph_matrix, matrices = _tensor_variables(cfg, graph, statistics)
+    return _matrices_to_triplets(matrices, graph_matrix)
+
+
+def tensor_reachability(
+        cfg: Union[CFG, GrammarIndex], graph: nx.MultiDiGraph, start_nodes: Iterable = None,
+        final_nodes: Iterable = None, start_symbol: Variable = Variable("S"), statistics: IterationStatistics = None
+) -> Tuple[sp.csr_matrix, np.ndarray]:
+    """
+    Calculate reachability for start symbol with Tensor algorithm, without building triplets for all variables
+    :param cfg: CFG or GrammarIndex built from it
+    :param graph: Graph
+    :param start_nodes: Set of start nodes, all nodes by default
+    :param final_nodes: Set of final nodes, all nodes by default
+    :param start_symbol: Start symbol, defaults to "S"
+    :param statistics: (optional) collects number of rounds and nonterminal edges added per round
+    :return: boolean matrix of start symbol masked by start (rows) and final (columns) nodes,
+    and graph nodes in matrix index order
+    """
+    _set_start_symbol(cfg, start_symbol)
+    graph_matrix, matrices = _tensor_variables(cfg, graph, statistics)
+    return _mask_matrix(matrices.get(start_symbol), graph_matrix, start_nodes, final_nodes)
+
+
+def _tensor_variables(
+        cfg: Union[CFG, GrammarIndex], graph: nx.MultiDiGraph, statistics: IterationStatistics = None
+) -> Tuple[AdjacencyMatrix, Dict[Variable, sp.csr_matrix]]:
+    """
+    Helper function running Tensor algorithm.
+    Works on Recursive Finite Automata of the grammar, so no normal form is needed: boxes are intersected
+    with the graph, and for every path from start to final state of box V an edge labeled V is added
+    to the graph until nothing changes. Nonterminal edges are kept under their own labels, so graph edges
+    labeled like a nonterminal are not mistaken for its derivations. Closure is updated incrementally with Kronecker products
+    of the added edges only
+    :return: graph AdjacencyMatrix and variable -> boolean matrix
+    """
     node_count = graph.number_of_nodes()
-    if node_count == 0:
+    if isinstance(cfg, GrammarIndex):
+        rsm, rsm_matrix = cfg.get_rsm(), cfg.get_rsm_matrix()
+    else:
+        rsm = cfg_to_rsm(cfg)
+        rsm_matrix = rsm.get_united_adjacency_matrix()
+    graph_matrix = AdjacencyMatrix.from_graph(graph)
+    rsm_length = rsm_matrix.get_states_len()
+
+    box_names = list(rsm.boxes.keys())
+    box_symbols = {name: Symbol(_NonterminalLabel(name)) for name in box_names}
+    rsm_matrix = copy.copy(rsm_matrix)
+    rsm_matrix.matrix = {
+        box_symbols.get(symbol.value, symbol): matrix for symbol, matrix in rsm_matrix.matrix.items()
+    }
+    box_ids = {name: box_id for box_id, name in enumerate(box_names)}
+    state_boxes = np.fromiter((box_ids[state.value[0]] for state in rsm_matrix.index_states), dtype=np.int64)
+    rsm_start_mask = np.zeros(rsm_length, dtype=bool)
+    rsm_start_mask[rsm_matrix.indices_by_states(rsm_matrix.start_states)] = True
+    rsm_final_mask = np.zeros(rsm_length, dtype=bool)
+    rsm_final_mask[rsm_matrix.indices_by_states(rsm_matrix.final_states)] = True
+
+    empty = sp.csr_matrix((node_count, node_count), dtype=bool)
+    deltas = {box_symbols[name]: empty for name in box_names}
+    for name, dfa in rsm.boxes.items():
+        if any(state in dfa.final_states for state in dfa.start_states):
+            deltas[box_symbols[name]] = sp.identity(node_count, dtype=bool, format="csr")
+    for symbol, delta in deltas.items():
+        graph_matrix.matrix[symbol] = graph_matrix.matrix.get(symbol, empty) + delta
+
+    closure = intersect_adjacency_matrices(graph_matrix, rsm_matrix).get_transitive_closure()
+    while True:
+        rows, cols = closure.nonzero()
+        graph_from, rsm_from = np.divmod(rows, rsm_length)
+        graph_to, rsm_to = np.divmod(cols, rsm_length)
+        boxes = state_boxes[rsm_from]
+        accepted = rsm_start_mask[rsm_from] & rsm_final_mask[rsm_to] & (boxes == state_boxes[rsm_to])
+
+        deltas = dict()
+        for box_id, name in enumerate(box_names):
+            selected = accepted & (boxes == box_id)
+            found = sp.csr_matrix(
+                (np.ones(np.count_nonzero(selected), dtype=bool), (graph_from[selected], graph_to[selected])),
+                shape=(node_count, node_count),
+                dtype=bool,
+            )
+            symbol = box_symbols[name]
+            delta = found > graph_matrix.matrix[symbol]
+            if delta.nnz != 0:
+                deltas[symbol] = delta
+                graph_matrix.matrix[symbol] = graph_matrix.matrix[symbol] + delta
+
+        if statistics is not None:
+            statistics.add_iteration(sum(delta.nnz for delta in deltas.values()))
+        if len(deltas) == 0:
+            break
+
+        new_edges = sp.csr_matrix(closure.shape, dtype=bool)
+        for symbol, delta in deltas.items():
+            if symbol in rsm_matrix.matrix:
+                new_edges += sp.kron(delta, rsm_matrix.matrix[symbol], format="csr")
+        closure = transitive_closure(new_edges, closed=closure)
+
+    return graph_matrix, {Variable(name): graph_matrix.matrix[box_symbols[name]] for name in box_names}
+
+
+class _NonterminalLabel:
+    """
+    Label of nonterminal edges added by Tensor algorithm, never equal to labels of graph edges
+    """
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, _NonterminalLabel) and other.name == self.name
+
+    def __hash__(self):
+        return hash((_NonterminalLabel, self.name))
+
+    def __repr__(self):
+        return f"_NonterminalLabel({self.name!r})"
+
+
+def gll_(
+        cfg: Union[CFG, GrammarIndex], graph: nx.MultiDiGraph, start_nodes: Iterable = None,
+        final_nodes: Iterable = None, start_symbol: Variable = Variable("S")
+) -> Set[Tuple]:
+    """
+    Calculate reachability from given vertices with GLL algorithm on Recursive Finite Automata of given CFG.
+    Descriptors (box, box state, vertex, stack node) are processed from a worklist, calls of nonterminals
+    share nodes of graph-structured stack, so only the part of the graph reachable from start nodes is explored
+    :param cfg: CFG or GrammarIndex built from it
+    :param graph: Graph
+    :param start_nodes: Set of start nodes, all nodes by default
+    :param final_nodes: Set of final nodes, all nodes by default
+    :param start_symbol: Start symbol, defaults to "S"
+    :return: triplets (vertex, start_symbol, vertex) Vertex - NonTerminal - Vertex
+    """
+    if start_nodes is None:
+        start_nodes = graph.nodes
+
+    rsm = cfg.get_rsm() if isinstance(cfg, GrammarIndex) else cfg_to_rsm(cfg)
+    if start_symbol.value not in rsm.boxes:
         return set()
+    transitions = {box: dfa.to_dict() for box, dfa in rsm.boxes.items()}
 
-    wcnf = cfg_to_weak_cnf(cfg)
-    matrices = defaultdict(set)
-    for var in wcnf.variables:
-        matrices[var] = sp.dok_matrix((node_count, node_count), dtype=np.bool_)
-
-    for productions in wcnf.productions:
-        matrix = matrices[productions.head]
-        l = len(productions.body)
-        if l == 0:
-            for i in range(node_count):
-                matrix[i, i] = 1
-            continue
-        elif l == 1:
-            term = productions.body[0]
-            if isinstance(term, Terminal):
-                term = term.value
-                for v, u, l in graph.edges(data="label"):
-                    if l == term:
-                        matrix[v, u] = 1
-        elif l == 2:
+    out_edges = dict()
+
+    def get_out_edges(node) -> Dict:
+        if node not in out_edges:
+            by_label = defaultdict(list)
+            for _, node_to, label in graph.out_edges(node, data="label"):
+                by_label[label].append(node_to)
+            out_edges[node] = by_label
+        return out_edges[node]
+
+    gss_edges = defaultdict(set)
+    popped = defaultdict(set)
+    visited = set()
+    queue = deque()
+
+    def add(descriptor):
+        if descriptor not in visited:
+            visited.add(descriptor)
+            queue.append(descriptor)
+
+    for node in start_nodes:
+        if graph.has_node(node):
+            box = start_symbol.value
+            add((box, rsm.boxes[box].start_state, node, (box, node)))
+
+    while len(queue) != 0:
+        box, state, node, gss_node = queue.popleft()
+
+        if state in rsm.boxes[box].final_states and node not in popped[gss_node]:
+            popped[gss_node].add(node)
+            for return_box, return_state, return_gss_node in tuple(gss_edges[gss_node]):
+                add((return_box, return_state, node, return_gss_node))
+
+        for symbol, next_state in transitions[box].get(state, dict()).items():
+            if symbol.value in rsm.boxes:
+                callee = (symbol.value, node)
+                edge = (box, next_state, gss_node)
+                if edge not in gss_edges[callee]:
+                    gss_edges[callee].add(edge)
+                    for popped_node in tuple(popped[callee]):
+                        add((box, next_state, popped_node, gss_node))
+                add((symbol.value, rsm.boxes[symbol.value].start_state, node, callee))
+            else:
+                for node_to in get_out_edges(node).get(symbol.value, ()):
+                    add((box, next_state, node_to, gss_node))
+
+    final_nodes = _get_node_set(graph, final_nodes)
+    result = set()
+    for node in start_nodes:
+        for node_to in popped[(start_symbol.value, node)]:
+            if node_to in final_nodes:
+                result.add((node, start_symbol, node_to))
+    return result
+
+
+def cfpq_shortest_paths(
+        graph: nx.MultiDiGraph, cfg: Union[CFG, GrammarIndex], start_nodes: Set = None, final_nodes: Set = None,
+        start_symbol: Variable = Variable("S")
+) -> "CFPQPaths":
+    """
+    Calculates cfpq answer keeping the shortest derivation of every triplet, so a shortest witness path
+    can be reconstructed for every answer. Works like Hellings algorithm with the worklist ordered by path length
+    (Knuth's generalization of Dijkstra algorithm): a triplet is final when popped and is combined only with final
+    ones, so its first derivation is the shortest. Derivations are kept only by this function.
+    The search itself holds the heap and Python indexes of derived triplets, like hellings_;
+    the result keeps only compact arrays, see CFPQPaths
+    :param graph: Graph
+    :param cfg: CFG or GrammarIndex built from it, index must have the same start symbol
+    :param start_nodes: Set of start nodes, all nodes by default
+    :param final_nodes: Set of final nodes, all nodes by default
+    :param start_symbol: Start symbol, defaults to "S"
+    :return: CFPQPaths
+    """
+    _set_start_symbol(cfg, start_symbol)
+    index = get_grammar_index(cfg)
+    nodes = np.fromiter(graph.nodes, dtype=object, count=graph.number_of_nodes())
+    node_indices = {node: node_index for node_index, node in enumerate(nodes.tolist())}
+    node_count = len(nodes)
+    var_ids = {var: var_id for var_id, var in enumerate(index.wcnf.variables)}
+    step_ids = {(): 0}
+    left_to_right = {
+        var_ids[left]: [(var_ids[right], [var_ids[head] for head in heads]) for right, heads in pairs]
+        for left, pairs in index.left_to_right.items()
+    }
+    right_to_left = {
+        var_ids[right]: [(var_ids[left], [var_ids[head] for head in heads]) for left, heads in pairs]
+        for right, pairs in index.right_to_left.items()
+    }
+
+    counter = itertools.count()
+    queue = []
+    best = dict()
+    found = set()
+    keys, lengths, splits, steps = [], [], [], []
+    incoming = defaultdict(dict)
+    outgoing = defaultdict(dict)
+
+    def push(u, var, v, length, split, step):
+        key = (var * node_count + u) * node_count + v
+        if key not in found and length < best.get(key, length + 1):
+            best[key] = length
+            heapq.heappush(queue, (length, next(counter), key, split, step))
+
+    for var in index.eps_heads:
+        for node in range(node_count):
+            push(node, var_ids[var], node, 0, -1, 0)
+    for node_from, node_to, label in graph.edges(data="label"):
+        for var in index.terminal_to_heads.get(label, ()):
+            step = step_ids.setdefault((label,), len(step_ids))
+            push(node_indices[node_from], var_ids[var], node_indices[node_to], 1, -1, step)
+
+    while len(queue) != 0:
+        length, _, key, split, step = heapq.heappop(queue)
+        if key in found:
             continue
+        found.add(key)
+        keys.append(key)
+        lengths.append(length)
+        splits.append(split)
+        steps.append(step)
+        var_1, u_1, v_1 = key // (node_count * node_count), key // node_count % node_count, key % node_count
+        incoming[(v_1, var_1)][u_1] = length
+        outgoing[(u_1, var_1)][v_1] = length
 
-    for var, matrix in matrices.items():
-        matrix.tocsr()
+        for var_2, heads in right_to_left.get(var_1, ()):
+            step = step_ids.setdefault((var_2, var_1), len(step_ids))
+            for u_2, length_2 in tuple(incoming[(u_1, var_2)].items()):
+                for head in heads:
+                    push(u_2, head, v_1, length_2 + length, u_1, step)
 
-    while True:
-        new_matrices = defaultdict(set)
-        for var in wcnf.variables:
-            new_matrices[var] = sp.csr_matrix((node_count, node_count), dtype=np.bool_)
+        for var_2, heads in left_to_right.get(var_1, ()):
+            step = step_ids.setdefault((var_1, var_2), len(step_ids))
+            for v_2, length_2 in tuple(outgoing[(v_1, var_2)].items()):
+                for head in heads:
+                    push(u_1, head, v_2, length + length_2, v_1, step)
+
+    keys = np.array(keys, dtype=np.int64)
+    order = np.argsort(keys)
+    return CFPQPaths(
+        nodes, list(var_ids), list(step_ids), keys[order],
+        np.array(lengths, dtype=_get_int_dtype(max(lengths, default=0)))[order],
+        np.array(splits, dtype=_get_int_dtype(node_count))[order],
+        np.array(steps, dtype=_get_int_dtype(len(step_ids)))[order],
+        start_symbol, _get_index_mask(node_indices, start_nodes), _get_index_mask(node_indices, final_nodes),
+    )
+
+
+class CFPQPaths:
+    """
+    Class representing answer of Context Free Path Query with the shortest derivation of every triplet.
+    Triplets (u, variable, v) are kept in arrays sorted by key (variable id * |V| + u) * |V| + v over node indices,
+    with the length of the shortest path, the split node (-1 for epsilon and edges) and the id of the last step:
+    () for epsilon, (label,) for an edge and (left variable id, right variable id) for a split.
+    Lengths, splits and steps take the smallest integer type that fits, so a triplet costs 14 bytes or less
+    """
+    def __init__(
+            self, nodes: np.ndarray, variables: List[Variable], steps: List[Tuple], keys: np.ndarray,
+            lengths: np.ndarray, splits: np.ndarray, step_ids: np.ndarray, start_symbol: Variable,
+            start_mask: np.ndarray, final_mask: np.ndarray
+    ):
+        self.nodes = nodes
+        self.variables = variables
+        self.steps = steps
+        self.keys = keys
+        self.lengths = lengths
+        self.splits = splits
+        self.step_ids = step_ids
+        self.start_symbol = start_symbol
+        self.start_mask = start_mask
+        self.final_mask = final_mask
+        self._node_indices = {node: node_index for node_index, node in enumerate(nodes.tolist())}
+        self._var_ids = {var: var_id for var_id, var in enumerate(variables)}
+
+    def get_pairs(self) -> Set[Tuple]:
+        """
+        :return: pairs (start, end) of all answers, same as cfpq(...)
+        """
+        var_id = self._var_ids.get(self.start_symbol)
+        if var_id is None:
+            return set()
+        square = len(self.nodes) * len(self.nodes)
+        first, last = np.searchsorted(self.keys, [var_id * square, (var_id + 1) * square])
+        keys = self.keys[first:last]
+        sources, targets = keys // len(self.nodes) % len(self.nodes), keys % len(self.nodes)
+        selected = self.start_mask[sources] & self.final_mask[targets]
+        return set(zip(self.nodes[sources[selected]].tolist(), self.nodes[targets[selected]].tolist()))
+
+    def get_length(self, start, end) -> Union[int, None]:
+        """
+        :param start: Start node
+        :param end: Final node
+        :return: length of the shortest path derivable from start symbol, None if (start, end) is not an answer
+        """
+        position = self._find_answer(start, end)
+        return None if position is None else int(self.lengths[position])
+
+    def get_path(self, start, end) -> Union[List[Tuple], None]:
+        """
+        Reconstructs the shortest path by unfolding kept derivations
+        :param start: Start node
+        :param end: Final node
+        :return: edges (node_from, node_to, label) of the shortest path derivable from start symbol,
+        None if (start, end) is not an answer
+        """
+        if self._find_answer(start, end) is None:
+            return None
+        path = []
+        stack = [(self._node_indices[start], self._var_ids[self.start_symbol], self._node_indices[end])]
+        while len(stack) != 0:
+            u, var, v = stack.pop()
+            position = self._find(u, var, v)
+            step = self.steps[self.step_ids[position]]
+            if len(step) == 1:
+                path.append((self.nodes[u], self.nodes[v], step[0]))
+            elif len(step) == 2:
+                split = int(self.splits[position])
+                left, right = step
+                stack.append((split, right, v))
+                stack.append((u, left, split))
+        return path
+
+    def _find_answer(self, start, end) -> Union[int, None]:
+        """
+        Helper function to get position of the start symbol triplet of an answer
+        """
+        u, v = self._node_indices.get(start), self._node_indices.get(end)
+        var = self._var_ids.get(self.start_symbol)
+        if u is None or v is None or var is None or not self.start_mask[u] or not self.final_mask[v]:
+            return None
+        return self._find(u, var, v)
+
+    def _find(self, u: int, var: int, v: int) -> Union[int, None]:
+        """
+        Helper function to get position of the triplet in arrays
+        """
+        key = (var * len(self.nodes) + u) * len(self.nodes) + v
+        position = np.searchsorted(self.keys, key)
+        return int(position) if position < len(self.keys) and self.keys[position] == key else None
 
-        for productions in wcnf.productions:
-            l = len(productions.body)
-            if l != 2:
+
+class IncrementalCFPQ:
+    """
+    Class maintaining Matrix algorithm variable matrices under batches of edge insertions and deletions.
+    Insertions seed semi-naive fixpoint with the new terminal entries only. Deletions use delete and rederive:
+    entries whose path could pass a removed edge (from a node reaching its source to a node reachable from
+    its target) are dropped, then only those of them derivable from the remaining entries are restored
+    """
+    def __init__(
+            self, graph: nx.MultiDiGraph, cfg: Union[CFG, GrammarIndex], start_nodes: Set = None,
+            final_nodes: Set = None, start_symbol: Variable = Variable("S")
+    ):
+        """
+        :param graph: Initial graph
+        :param cfg: CFG or GrammarIndex built from it
+        :param start_nodes: Set of start nodes, all nodes of the current graph by default
+        :param final_nodes: Set of final nodes, all nodes of the current graph by default
+        :param start_symbol: Start symbol, defaults to "S"
+        """
+        _set_start_symbol(cfg, start_symbol)
+        self.index = get_grammar_index(cfg)
+        self.start_nodes = start_nodes
+        self.final_nodes = final_nodes
+        self.start_symbol = start_symbol
+        self.graph_matrix = AdjacencyMatrix.from_graph(graph)
+        self.matrices = _matrix_fixpoint(self.index, _get_initial_matrices(self.index, self.graph_matrix))
+
+    def insert_edges(self, edges: Iterable[Tuple]):
+        """
+        Adds edges to the graph and updates variable matrices
+        :param edges: Edges (node_from, node_to, label), new nodes are added to the graph
+        :return: None
+        """
+        old_count = self.graph_matrix.get_states_len()
+        edge_matrices = self.graph_matrix.get_edge_matrices(edges)
+        node_count = self.graph_matrix.get_states_len()
+        self.matrices = {var: resize_matrix(matrix, node_count) for var, matrix in self.matrices.items()}
+
+        new_nodes = sp.diags(np.arange(node_count) >= old_count, dtype=bool, format="csr")
+        deltas = {var: new_nodes for var in self.index.eps_heads}
+        for symbol, matrix in edge_matrices.items():
+            graph_matrix = self.graph_matrix.matrix.get(symbol)
+            self.graph_matrix.matrix[symbol] = matrix if graph_matrix is None else graph_matrix + matrix
+            for var in self.index.terminal_to_heads.get(symbol.value, ()):
+                deltas[var] = deltas[var] + matrix if var in deltas else matrix
+        self._propagate(deltas)
+
+    def delete_edges(self, edges: Iterable[Tuple]):
+        """
+        Removes edges from the graph and updates variable matrices. Graph is treated as a set of labeled edges,
+        so all parallel edges with the same label are removed at once
+        :param edges: Edges (node_from, node_to, label), unknown edges are ignored
+        :return: None
+        """
+        node_count = self.graph_matrix.get_states_len()
+        adjacency = sp.csr_matrix((node_count, node_count), dtype=bool)
+        for matrix in self.graph_matrix.matrix.values():
+            adjacency = adjacency + matrix
+
+        removed = sp.csr_matrix((node_count, node_count), dtype=bool)
+        for symbol, matrix in self.graph_matrix.get_edge_matrices(edges, add_states=False).items():
+            graph_matrix = self.graph_matrix.matrix.get(symbol)
+            if graph_matrix is None:
                 continue
-            x = matrices[productions.body[0]] * (matrices[productions.body[1]])
-            new_matrices[productions.head] += x
-
-        prev_non_zero = defaultdict(set)
-        for var, matrix in matrices.items():
-            prev_non_zero[var] = matrix.count_nonzero()
-        for nt, m in new_matrices.items():
-            matrices[nt] += m
-        cur_non_zero = defaultdict(set)
-        for var, matrix in matrices.items():
-            cur_non_zero[var] = matrix.count_nonzero()
-        if prev_non_zero == cur_non_zero:
-            break
+            matrix = graph_matrix.multiply(matrix).tocsr()
+            self.graph_matrix.matrix[symbol] = graph_matrix > matrix
+            removed = removed + matrix
+        if removed.nnz == 0:
+            return
+
+        removed_from, removed_to = removed.nonzero()
+        rows = sp.diags(_get_reachable_mask(adjacency.T.tocsr(), removed_from), dtype=bool, format="csr")
+        cols = sp.diags(_get_reachable_mask(adjacency, removed_to), dtype=bool, format="csr")
+        self.matrices = {var: matrix > rows @ matrix @ cols for var, matrix in self.matrices.items()}
+
+        candidates = _get_initial_matrices(self.index, self.graph_matrix)
+        for head, bodies in self.index.var_to_var_dict.items():
+            for left, right in bodies:
+                candidates[head] = candidates[head] + (rows @ self.matrices[left]) @ self.matrices[right]
+        self._propagate({var: rows @ matrix @ cols for var, matrix in candidates.items()})
+
+    def get_result(self, sparse_result: bool = False) -> Union[Set[Tuple], NodePairs]:
+        """
+        :param sparse_result: return NodePairs backed by sparse matrix instead of Python set
+        :return: pairs of nodes connected by start symbol on the current graph, same as cfpq(..., "matrix")
+        """
+        result = NodePairs(*_mask_matrix(
+            self.matrices.get(self.start_symbol), self.graph_matrix, self.start_nodes, self.final_nodes
+        ))
+        return result if sparse_result else result.to_set()
+
+    def _propagate(self, deltas: Dict[Variable, sp.spmatrix]):
+        """
+        Helper function adding new entries of deltas to variable matrices and running fixpoint from them
+        """
+        new_deltas = dict()
+        for var, delta in deltas.items():
+            delta = delta > self.matrices[var]
+            if delta.nnz != 0:
+                new_deltas[var] = delta
+                self.matrices[var] = self.matrices[var] + delta
+        self.matrices = _matrix_fixpoint(self.index, self.matrices, new_deltas)
+
+
+def _set_start_symbol(cfg: Union[CFG, GrammarIndex], start_symbol: Variable):
+    """
+    Helper function to query grammar from given start symbol. GrammarIndex keeps only variables useful
+    for the start symbol it was built with, so it can not be queried from another one
+    """
+    if isinstance(cfg, CFG):
+        cfg._start_symbol = start_symbol
+    elif start_symbol != cfg.start_symbol:
+        raise ValueError(
+            f"GrammarIndex is built for start symbol {cfg.start_symbol}, can not query it from {start_symbol}"
+        )
+
+
+def _get_index_mask(node_indices: Dict, nodes: Iterable = None) -> np.ndarray:
+    """
+    Helper function to get indicator vector of given nodes over node indices, all nodes by default
+    """
+    if nodes is None:
+        return np.ones(len(node_indices), dtype=bool)
+    mask = np.zeros(len(node_indices), dtype=bool)
+    mask[[node_indices[node] for node in nodes if node in node_indices]] = True
+    return mask
 
+
+def _get_int_dtype(max_value: int) -> np.dtype:
+    """
+    Helper function to get the smallest signed integer type holding values from -1 to max_value
+    """
+    for dtype in (np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _get_node_set(graph: nx.MultiDiGraph, nodes: Iterable = None):
+    """
+    Helper function to get container of given nodes with fast membership test, all graph nodes by default
+    """
+    if nodes is None:
+        return graph.nodes
+    return set(nodes)
+
+
+def _get_reachable_mask(adjacency: sp.csr_matrix, sources: np.ndarray) -> np.ndarray:
+    """
+    Helper function to get indicator vector of nodes reachable from given source indices, sources included
+    """
+    visited = np.zeros(adjacency.shape[0], dtype=bool)
+    visited[sources] = True
+    front = visited
+    transposed = adjacency.T.tocsr()
+    while front.any():
+        front = (transposed @ front.astype(np.int32) != 0) & ~visited
+        visited = visited | front
+    return visited
+
+
+def _get_node_mask(graph_matrix: AdjacencyMatrix, nodes: Iterable = None) -> np.ndarray:
+    """
+    Helper function to get indicator vector of given nodes, all nodes by default
+    """
+    if nodes is None:
+        return np.ones(graph_matrix.get_states_len(), dtype=bool)
+    states = (State(node) for node in nodes)
+    mask = np.zeros(graph_matrix.get_states_len(), dtype=bool)
+    mask[graph_matrix.indices_by_states(state for state in states if state in graph_matrix.state_indices)] = True
+    return mask
+
+
+def _mask_matrix(
+        matrix: sp.csr_matrix, graph_matrix: AdjacencyMatrix, start_nodes: Iterable = None, final_nodes: Iterable = None
+) -> Tuple[sp.csr_matrix, np.ndarray]:
+    """
+    Helper function keeping only rows of start nodes and columns of final nodes
+    :return: masked matrix and graph nodes in matrix index order
+    """
+    node_count = graph_matrix.get_states_len()
+    if matrix is None:
+        return sp.csr_matrix((node_count, node_count), dtype=bool), graph_matrix.get_state_values()
+
+    start_mask = sp.diags(_get_node_mask(graph_matrix, start_nodes), dtype=bool, format="csr")
+    final_mask = sp.diags(_get_node_mask(graph_matrix, final_nodes), dtype=bool, format="csr")
+    masked = start_mask @ matrix @ final_mask
+    masked.eliminate_zeros()
+    return masked, graph_matrix.get_state_values()
+
+
+def _matrices_to_triplets(matrices: Dict[Variable, sp.csr_matrix], graph_matrix: AdjacencyMatrix) -> Set[Tuple]:
+    """
+    Helper function to get triplets (vertex, variable, vertex) of all entries of variable matrices
+    """
+    nodes = graph_matrix.get_state_values()
     result = set()
     for var, matrix in matrices.items():
-        matrix = matrix.tocoo()
-        for u, v, b in zip(matrix.row, matrix.col, matrix.data):
-            if b == True:
-                result.add((u, var, v))
+        rows, cols = matrix.nonzero()
+        result.update(zip(nodes[rows], [var] * len(rows), nodes[cols]))
     return result
 
+
+def _get_initial_matrices(index: GrammarIndex, graph_matrix: AdjacencyMatrix) -> Dict[Variable, sp.csr_matrix]:
+    """
+    Helper function building csr matrices of all variables from epsilon and terminal productions,
+    graph edges are taken from graph_matrix already grouped by label
+    """
+    node_count = graph_matrix.get_states_len()
+    matrices = {var: sp.csr_matrix((node_count, node_count), dtype=bool) for var in index.wcnf.variables}
+
+    for var in index.eps_heads:
+        matrices[var] = matrices[var] + sp.identity(node_count, dtype=bool, format="csr")
+    for terminal, heads in index.terminal_to_heads.items():
+        label_matrix = graph_matrix.matrix.get(Symbol(terminal))
+        if label_matrix is None:
+            continue
+        for var in heads:
+            matrices[var] = matrices[var] + label_matrix
+
+    return matrices
+
+
+def _matrix_fixpoint(
+        index: GrammarIndex, matrices: Dict[Variable, sp.spmatrix], deltas: Dict[Variable, sp.spmatrix] = None,
+        statistics: IterationStatistics = None, backend: Union[str, SparseBackend] = None
+) -> Dict[Variable, sp.csr_matrix]:
+    """
+    Helper function computing fixpoint of A += B * C for all productions A -> B C with semi-naive evaluation:
+    every round multiplies only entries added in the previous round (delta) as dB * C + B * dC,
+    and only productions with a changed body variable are evaluated
+    :param index: GrammarIndex
+    :param matrices: variable -> boolean matrix
+    :param deltas: (optional) entries of matrices not yet propagated, all of them by default
+    :param statistics: (optional) collects number of rounds and entries discovered per round
+    :param backend: (optional) SparseBackend or its name running the products, scipy by default
+    :return: variable -> boolean csr matrix at fixpoint
+    """
+    backend = get_backend(backend)
+    if deltas is None:
+        deltas = matrices
+    deltas = {var: backend.from_scipy(delta) for var, delta in deltas.items() if delta.nnz != 0}
+    matrices = {var: backend.from_scipy(matrix) for var, matrix in matrices.items()}
+
+    productions_by_body = defaultdict(set)
+    for head, bodies in index.var_to_var_dict.items():
+        for left, right in bodies:
+            productions_by_body[left].add((head, left, right))
+            productions_by_body[right].add((head, left, right))
+
+    while len(deltas) != 0:
+        scheduled = set()
+        for var in deltas:
+            scheduled.update(productions_by_body[var])
+
+        new_matrices = dict()
+        for head, left, right in scheduled:
+            product = None
+            if left in deltas:
+                product = backend.mxm(deltas[left], matrices[right])
+            if right in deltas:
+                right_product = backend.mxm(matrices[left], deltas[right])
+                product = right_product if product is None else backend.add(product, right_product)
+            new_matrices[head] = product if head not in new_matrices else backend.add(new_matrices[head], product)
+
+        deltas = dict()
+        for head, new_matrix in new_matrices.items():
+            delta = backend.subtract(new_matrix, matrices[head])
+            if backend.nnz(delta) != 0:
+                deltas[head] = delta
+                matrices[head] = backend.add(matrices[head], delta)
+
+        if statistics is not None:
+            statistics.add_iteration(sum(backend.nnz(delta) for delta in deltas.values()))
+
+    return {var: backend.to_scipy(matrix) for var, matrix in matrices.items()}
@@ -1,8 +1,12 @@
-from typing import Dict
+import hashlib
+from collections import defaultdict
+from typing import Dict, Union
 
-from pyformlang.cfg import CFG, Variable
+from pyformlang.cfg import CFG, Variable, Terminal
 from pyformlang.regular_expression import Regex
-from project.ecfg_util import ECFG
+from project.cache_util import CompilationCache
+from project.ecfg_util import ECFG, RecursiveFiniteAutomata
+from project.matrix_util import AdjacencyMatrix
 
 
 def cfg_to_weak_cnf(cfg: CFG) -> CFG:
@@ -16,6 +20,104 @@ def cfg_to_weak_cnf(cfg: CFG) -> CFG:
     return CFG(start_symbol=cleared_cfg.start_symbol, productions=set(cleared_cfg_productions))
 
 
+class GrammarIndex:
+    """
+    Class representing weak chomsky normal form of a CFG with its productions indexed for CFPQ algorithms.
+    Build it once and pass it instead of CFG to run several queries with the same grammar
+    """
+    def __init__(self, cfg: CFG):
+        self.cfg = cfg
+        self.wcnf = cfg_to_weak_cnf(cfg)
+        self.start_symbol = self.wcnf.start_symbol
+        self.eps_heads = set()
+        self.terminal_to_heads = defaultdict(set)
+        self.var_to_var_dict = defaultdict(set)
+
+        for production in self.wcnf.productions:
+            body = production.body
+            if len(body) == 0:
+                self.eps_heads.add(production.head)
+            elif len(body) == 1 and isinstance(body[0], Terminal):
+                self.terminal_to_heads[body[0].value].add(production.head)
+            elif len(body) == 2:
+                self.var_to_var_dict[production.head].add((body[0], body[1]))
+
+        body_to_heads = defaultdict(set)
+        for head, bodies in self.var_to_var_dict.items():
+            for body in bodies:
+                body_to_heads[body].add(head)
+
+        self.left_to_right = defaultdict(list)
+        self.right_to_left = defaultdict(list)
+        for (left, right), heads in body_to_heads.items():
+            self.left_to_right[left].append((right, heads))
+            self.right_to_left[right].append((left, heads))
+
+        self._ecfg = None
+        self._rsm = None
+        self._rsm_matrix = None
+
+    def get_ecfg(self) -> ECFG:
+        """
+        :return: ECFG of the original grammar, built once
+        """
+        if self._ecfg is None:
+            self._ecfg = convert_cfg_to_ecfg(self.cfg)
+        return self._ecfg
+
+    def get_rsm(self) -> RecursiveFiniteAutomata:
+        """
+        :return: minimized Recursive Finite Automata of the original grammar, built once
+        """
+        if self._rsm is None:
+            self._rsm = self.get_ecfg().convert_to_RecursiveFiniteAutomata().minimize_RecursiveFiniteAutomata()
+        return self._rsm
+
+    def get_rsm_matrix(self) -> AdjacencyMatrix:
+        """
+        :return: united Adjacency Matrix of all boxes of the RSM, built once
+        """
+        if self._rsm_matrix is None:
+            self._rsm_matrix = self.get_rsm().get_united_adjacency_matrix()
+        return self._rsm_matrix
+
+    def compile(self):
+        """
+        Builds all lazily computed artifacts, so they are kept when the index is cached or pickled
+        :return: self
+        """
+        self.get_rsm_matrix()
+        return self
+
+
+GRAMMAR_CACHE = CompilationCache(maxsize=32)
+
+
+def compile_grammar(
+        text: str, start_symbol: Variable = Variable("S"), cache: CompilationCache = None
+) -> GrammarIndex:
+    """
+    Compiles grammar text to GrammarIndex with WCNF, production indexes, ECFG and RSM matrices through the cache
+    :param text: Grammar text
+    :param start_symbol: Starting Symbol
+    :param cache: (optional) cache to use, GRAMMAR_CACHE by default
+    :return: GrammarIndex shared with other callers
+    """
+    cache = GRAMMAR_CACHE if cache is None else cache
+    key = ("grammar", hashlib.sha256(text.encode()).hexdigest(), start_symbol.value)
+    return cache.get(key, lambda: GrammarIndex(CFG.from_text(text, start_symbol=start_symbol)).compile())
+
+
+def get_grammar_index(cfg: Union[CFG, GrammarIndex]) -> GrammarIndex:
+    """
+    :param cfg: CFG or already built GrammarIndex
+    :return: GrammarIndex of cfg
+    """
+    if isinstance(cfg, GrammarIndex):
+        return cfg
+    return GrammarIndex(cfg)
+
+
 def get_cfg_from_file(file: str, start_symbol: Variable = Variable("S")) -> CFG:
     """
     Load CFG from file
@@ -27,6 +129,26 @@ def get_cfg_from_file(file: str, start_symbol: Variable = Variable("S")) -> CFG:
         return CFG.from_text(f.read(), start_symbol=start_symbol)
 
 
+def get_grammar_index_from_file(file: str, start_symbol: Variable = Variable("S")) -> GrammarIndex:
+    """
+    Load compiled grammar from file through the grammar cache, see compile_grammar
+    :param file: file path as a string
+    :param start_symbol: Starting Symbol
+    :return: GrammarIndex
+    """
+    with open(file) as f:
+        return compile_grammar(f.read(), start_symbol)
+
+
+def cfg_to_rsm(cfg: CFG) -> RecursiveFiniteAutomata:
+    """
+    Converts CFG to minimized Recursive Finite Automata through ECFG
+    :param cfg: CFG
+    :return: RSM
+    """
+    return convert_cfg_to_ecfg(cfg).convert_to_RecursiveFiniteAutomata().minimize_RecursiveFiniteAutomata()
+
+
 def convert_cfg_to_ecfg(cfg: CFG) -> ECFG:
     """
     Converts CFG to ECFG
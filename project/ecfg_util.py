@@ -1,10 +1,10 @@
 from typing import AbstractSet, NamedTuple, Dict, Iterable
 
 from pyformlang.cfg import Variable
-from pyformlang.finite_automaton import DeterministicFiniteAutomaton
+from pyformlang.finite_automaton import DeterministicFiniteAutomaton, NondeterministicFiniteAutomaton, State
 from pyformlang.regular_expression import Regex
 
-from project.matrix_util import AdjacencyMatrix
+from project.matrix_util import AdjacencyMatrix, iterate_nfa
 
 
 class RecursiveFiniteAutomata(NamedTuple):
@@ -31,6 +31,21 @@ class RecursiveFiniteAutomata(NamedTuple):
         """
         return {var: AdjacencyMatrix(dfa) for var, dfa in self.boxes.items()}
 
+    def get_united_adjacency_matrix(self) -> AdjacencyMatrix:
+        """
+        Returns single AdjacencyMatrix of all boxes, its states are (variable, box state value) pairs
+        :return: AdjacencyMatrix with start and final states of every box
+        """
+        nfa = NondeterministicFiniteAutomaton()
+        for var, dfa in self.boxes.items():
+            for state_from, label, state_to in iterate_nfa(dfa):
+                nfa.add_transition(State((var, state_from.value)), label, State((var, state_to.value)))
+            for state in dfa.start_states:
+                nfa.add_start_state(State((var, state.value)))
+            for state in dfa.final_states:
+                nfa.add_final_state(State((var, state.value)))
+        return AdjacencyMatrix(nfa)
+
 class ECFG(NamedTuple):
     """
     Represents ECFG (Task2)
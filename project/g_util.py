@@ -1,7 +1,22 @@
-from typing import Set
+import hashlib
+import os
+import pathlib
+import re
+import tempfile
+from typing import Set, NamedTuple, Union, Sequence, Dict, Any, Iterator, Tuple
 
 import cfpq_data as cfpq
 import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+GRAPH_CACHE_DIR = pathlib.Path(
+    os.environ.get("FORMAL_LANG_GRAPH_CACHE", pathlib.Path.home() / ".cache" / "formal-lang-course" / "graphs")
+)
+EDGE_LIST_CHUNK_SIZE = 1 << 20
+_INTEGER_TOKEN = re.compile(r"[+-]?[0-9]+")
 
 
 class GraphInformation:
@@ -46,13 +61,413 @@ def build_two_cycle_labeled_graph(first_cycle: int, second_cycle: int, edge_labe
     return cfpq.labeled_two_cycles_graph(n=first_cycle, m=second_cycle, labels=edge_labels)
 
 
-def load_graph(graph_name: str) -> nx.MultiDiGraph:
+class GraphArrays(NamedTuple):
+    """
+    Represents labeled graph as contiguous arrays: edge i goes from nodes[sources[i]] to nodes[targets[i]]
+    and has label labels[label_ids[i]]
+    """
+    nodes: np.ndarray
+    sources: np.ndarray
+    targets: np.ndarray
+    label_ids: np.ndarray
+    labels: np.ndarray
+
+
+def graph_to_arrays(graph: nx.MultiDiGraph) -> GraphArrays:
+    """
+    Converts a graph to arrays
+    :param graph: Graph with "label" attribute on edges
+    :return: GraphArrays
+    """
+    nodes = list(graph.nodes)
+    node_indices = {node: index for index, node in enumerate(nodes)}
+    labels = dict()
+    edges_count = graph.number_of_edges()
+    sources = np.empty(edges_count, dtype=np.int64)
+    targets = np.empty(edges_count, dtype=np.int64)
+    label_ids = np.empty(edges_count, dtype=np.int64)
+    for i, (node_from, node_to, label) in enumerate(graph.edges(data="label")):
+        sources[i] = node_indices[node_from]
+        targets[i] = node_indices[node_to]
+        label_ids[i] = labels.setdefault(label, len(labels))
+
+    return GraphArrays(_to_value_array(nodes), sources, targets, label_ids, _to_value_array(list(labels)))
+
+
+def graph_from_arrays(arrays: GraphArrays) -> nx.MultiDiGraph:
+    """
+    Converts arrays back to a graph
+    :param arrays: GraphArrays
+    :return: Graph
+    """
+    nodes = arrays.nodes.tolist()
+    labels = arrays.labels.tolist()
+    graph = nx.MultiDiGraph()
+    graph.add_nodes_from(nodes)
+    graph.add_edges_from(
+        (nodes[node_from], nodes[node_to], {"label": labels[label_id]})
+        for node_from, node_to, label_id in zip(
+            arrays.sources.tolist(), arrays.targets.tolist(), arrays.label_ids.tolist()
+        )
+    )
+    return graph
+
+
+def label_matrices_from_arrays(
+        labels: Sequence, label_ids: np.ndarray, rows: np.ndarray, cols: np.ndarray, size: int
+) -> Dict[Any, sparse.csr_matrix]:
+    """
+    Builds boolean matrix for every label in one pass over edge index arrays
+    :param labels: Labels, label_ids refer to positions in this sequence
+    :param label_ids: Label id of every edge
+    :param rows: Source index of every edge
+    :param cols: Target index of every edge
+    :param size: Number of states
+    :return: dictionary label -> boolean csr matrix of shape (size, size)
+    """
+    order = np.argsort(label_ids, kind="stable")
+    sorted_ids = label_ids[order]
+    present_ids, bounds = np.unique(sorted_ids, return_index=True)
+    bounds = np.append(bounds, len(sorted_ids))
+
+    matrix = dict()
+    for position, label_id in enumerate(present_ids):
+        edges = order[bounds[position]:bounds[position + 1]]
+        matrix[labels[label_id]] = sparse.csr_matrix(
+            (np.ones(len(edges), dtype=bool), (rows[edges], cols[edges])),
+            shape=(size, size),
+            dtype=bool,
+        )
+    return matrix
+
+
+class LabeledGraph:
+    """
+    Class representing immutable labeled multigraph as contiguous arrays: edge i goes from
+    node_ids[sources[i]] to node_ids[targets[i]] and has label labels[label_ids[i]].
+    Supports the part of nx.MultiDiGraph interface used by query algorithms,
+    so it can be passed wherever a graph is expected
+    """
+    __slots__ = (
+        "node_ids", "sources", "targets", "label_ids", "labels",
+        "_node_indices", "_label_matrices", "_out_indptr", "_out_order",
+    )
+
+    _EDGES_CHUNK = 1 << 16
+
+    def __init__(
+            self, node_ids: np.ndarray, sources: np.ndarray, targets: np.ndarray,
+            label_ids: np.ndarray, labels: np.ndarray, label_matrices: Dict[Any, sparse.csr_matrix] = None
+    ):
+        """
+        :param node_ids: Unique node ids in index order
+        :param sources: Source node index of every edge
+        :param targets: Target node index of every edge
+        :param label_ids: Label index of every edge
+        :param labels: Unique labels
+        :param label_matrices: (optional) already built result of get_label_matrices
+        """
+        self.node_ids = node_ids
+        self.sources = sources
+        self.targets = targets
+        self.label_ids = label_ids
+        self.labels = labels
+        self._node_indices = None
+        self._label_matrices = label_matrices
+        self._out_indptr = None
+        self._out_order = None
+
+    @staticmethod
+    def from_arrays(arrays: GraphArrays):
+        """
+        Creates LabeledGraph from arrays without copying them, so memory-mapped arrays stay on disk
+        :param arrays: GraphArrays
+        :return: LabeledGraph
+        """
+        return LabeledGraph(arrays.nodes, arrays.sources, arrays.targets, arrays.label_ids, arrays.labels)
+
+    @staticmethod
+    def from_networkx(graph: nx.MultiDiGraph):
+        """
+        Creates LabeledGraph from networkx graph, node ids and labels are kept as is
+        :param graph: Graph with "label" attribute on edges
+        :return: LabeledGraph
+        """
+        return LabeledGraph.from_arrays(graph_to_arrays(graph))
+
+    @staticmethod
+    def from_csv(path, chunk_size: int = None):
+        """
+        Creates LabeledGraph from CFPQ_Data CSV file with "from to label" lines, see read_edge_list
+        :param path: Path to the CSV file, may be gzip compressed
+        :param chunk_size: (optional) number of lines parsed at once
+        :return: LabeledGraph
+        """
+        return read_edge_list(path, chunk_size=chunk_size)
+
+    def to_arrays(self) -> GraphArrays:
+        """
+        :return: GraphArrays sharing memory with the graph
+        """
+        return GraphArrays(self.node_ids, self.sources, self.targets, self.label_ids, self.labels)
+
+    def to_networkx(self) -> nx.MultiDiGraph:
+        """
+        :return: equivalent nx.MultiDiGraph
+        """
+        return graph_from_arrays(self.to_arrays())
+
+    def get_label_matrices(self) -> Dict[Any, sparse.csr_matrix]:
+        """
+        Gets boolean adjacency matrix of every label over node indices, matrices are built once and cached
+        :return: dictionary label -> boolean csr matrix
+        """
+        if self._label_matrices is None:
+            self._label_matrices = label_matrices_from_arrays(
+                self.labels.tolist(), self.label_ids, self.sources, self.targets, len(self.node_ids)
+            )
+        return self._label_matrices
+
+    @property
+    def nodes(self):
+        """
+        :return: set-like view of node ids in index order
+        """
+        return self._get_node_indices().keys()
+
+    def has_node(self, node) -> bool:
+        return node in self._get_node_indices()
+
+    def number_of_nodes(self) -> int:
+        return len(self.node_ids)
+
+    def number_of_edges(self) -> int:
+        return len(self.sources)
+
+    def edges(self, data=False) -> Iterator[Tuple]:
+        """
+        Iterates over edges like nx.MultiDiGraph.edges
+        :param data: "label" to get (from, to, label) triplets, (from, to) pairs otherwise
+        """
+        return self._iterate_edges(np.arange(len(self.sources)), data)
+
+    def out_edges(self, node, data=False) -> Iterator[Tuple]:
+        """
+        Iterates over outgoing edges of the node like nx.MultiDiGraph.out_edges
+        :param node: Node id
+        :param data: "label" to get (from, to, label) triplets, (from, to) pairs otherwise
+        """
+        if self._out_order is None:
+            self._out_order = np.argsort(self.sources, kind="stable")
+            self._out_indptr = np.concatenate(
+                ([0], np.cumsum(np.bincount(self.sources, minlength=len(self.node_ids))))
+            )
+        index = self._get_node_indices()[node]
+        return self._iterate_edges(self._out_order[self._out_indptr[index]:self._out_indptr[index + 1]], data)
+
+    def _iterate_edges(self, edges: np.ndarray, data) -> Iterator[Tuple]:
+        """
+        Helper function to decode edges by chunks, so Python objects are created only for the current chunk
+        """
+        for chunk_start in range(0, len(edges), self._EDGES_CHUNK):
+            chunk = edges[chunk_start:chunk_start + self._EDGES_CHUNK]
+            sources = self.node_ids[self.sources[chunk]].tolist()
+            targets = self.node_ids[self.targets[chunk]].tolist()
+            if data == "label":
+                yield from zip(sources, targets, self.labels[self.label_ids[chunk]].tolist())
+            else:
+                yield from zip(sources, targets)
+
+    def _get_node_indices(self) -> Dict:
+        if self._node_indices is None:
+            self._node_indices = {node: index for index, node in enumerate(self.node_ids.tolist())}
+        return self._node_indices
+
+    def __len__(self):
+        return self.number_of_nodes()
+
+    def __contains__(self, node):
+        return self.has_node(node)
+
+    def __repr__(self):
+        return f"LabeledGraph({self.number_of_nodes()} nodes, {self.number_of_edges()} edges)"
+
+
+def cache_graph(graph: Union[nx.MultiDiGraph, LabeledGraph, GraphArrays], graph_name: str, cache_dir=None) -> str:
+    """
+    Stores a graph in the local content-addressed cache: arrays are saved once per content digest
+    as .npy files, and graph name refers to the digest
+    :param graph: Graph or its arrays
+    :param graph_name: Name of the graph
+    :param cache_dir: (optional) cache directory, GRAPH_CACHE_DIR by default
+    :return: content digest of the graph
+    """
+    cache_dir = pathlib.Path(cache_dir or GRAPH_CACHE_DIR)
+    if isinstance(graph, LabeledGraph):
+        graph = graph.to_arrays()
+    arrays = graph if isinstance(graph, GraphArrays) else graph_to_arrays(graph)
+    arrays = GraphArrays(
+        *(np.ascontiguousarray(_to_value_array(array.tolist()) if array.dtype == object else array)
+          for array in arrays)
+    )
+    if any(array.dtype == object for array in arrays):
+        raise ValueError("Only graphs with node ids and labels that are all strings or all integers can be cached")
+
+    digest = hashlib.sha256()
+    for field, array in zip(GraphArrays._fields, arrays):
+        digest.update(f"{field}:{array.dtype.str}:{array.shape}".encode())
+        digest.update(array.tobytes())
+    digest = digest.hexdigest()
+
+    objects_dir = cache_dir / "objects"
+    object_dir = objects_dir / digest
+    if not object_dir.exists():
+        objects_dir.mkdir(parents=True, exist_ok=True)
+        tmp_dir = pathlib.Path(tempfile.mkdtemp(dir=objects_dir))
+        for field, array in zip(GraphArrays._fields, arrays):
+            np.save(tmp_dir / f"{field}.npy", array, allow_pickle=False)
+        try:
+            os.replace(tmp_dir, object_dir)
+        except OSError:
+            for file in tmp_dir.iterdir():
+                file.unlink()
+            tmp_dir.rmdir()
+
+    name_file = _get_cache_name_file(cache_dir, graph_name)
+    name_file.parent.mkdir(parents=True, exist_ok=True)
+    file_descriptor, tmp_file = tempfile.mkstemp(dir=name_file.parent)
+    with os.fdopen(file_descriptor, "w") as file:
+        file.write(digest)
+    os.replace(tmp_file, name_file)
+    return digest
+
+
+def load_graph_arrays(graph_name: str, cache_dir=None) -> GraphArrays:
+    """
+    Loads arrays of a graph from dataset through the local cache. Warm loads memory-map cached arrays
+    and skip both CSV parsing and networkx construction, cold loads download the graph, stream it
+    with read_edge_list and cache it
+    :param graph_name: Name of the graph
+    :param cache_dir: (optional) cache directory, GRAPH_CACHE_DIR by default
+    :return: GraphArrays
+    """
+    cache_dir = pathlib.Path(cache_dir or GRAPH_CACHE_DIR)
+    name_file = _get_cache_name_file(cache_dir, graph_name)
+    if name_file.exists():
+        object_dir = cache_dir / "objects" / name_file.read_text().strip()
+        if object_dir.exists():
+            return GraphArrays(
+                *(np.load(object_dir / f"{field}.npy", mmap_mode="r") for field in GraphArrays._fields)
+            )
+
+    arrays = read_edge_list(cfpq.download(graph_name)).to_arrays()
+    cache_graph(arrays, graph_name, cache_dir)
+    return arrays
+
+
+def _get_cache_name_file(cache_dir: pathlib.Path, graph_name: str) -> pathlib.Path:
+    """
+    Helper function to get file keeping digest of the named graph, names are scoped by dataset version
+    """
+    return cache_dir / "names" / cfpq.__version__ / graph_name
+
+
+def load_graph(graph_name: str, use_cache: bool = True, cache_dir=None) -> nx.MultiDiGraph:
     """
-    Loads a graph from dataset.
-    :param graph_name: Name of the graph.
+    Loads a graph from dataset or from local edge list file.
+    :param graph_name: Name of the graph or path to the edge list file, see read_edge_list.
+    :param use_cache: Use local graph cache, see load_graph_arrays
+    :param cache_dir: (optional) cache directory, GRAPH_CACHE_DIR by default
     :return: Graph
     """
-    return cfpq.graph_from_csv(cfpq.download(graph_name))
+    if os.path.isfile(graph_name):
+        return read_edge_list(graph_name).to_networkx()
+    if not use_cache:
+        return cfpq.graph_from_csv(cfpq.download(graph_name))
+    return graph_from_arrays(load_graph_arrays(graph_name, cache_dir))
+
+
+def read_edge_list(path, sep: str = " ", chunk_size: int = None) -> LabeledGraph:
+    """
+    Reads "from to label" edge list file by chunks, so neither the whole text nor a networkx graph
+    is kept in memory. Node ids and labels are mapped to indices incrementally in order of appearance
+    like in cfpq_data.graph_from_csv: integer node ids become ints, other node ids and all labels stay strings.
+    Per-label matrices are built from the index arrays once at the end
+    :param path: Path to the file, gzip and other compressions are inferred from the extension
+    :param sep: (optional) column separator, space by default
+    :param chunk_size: (optional) number of lines parsed at once, EDGE_LIST_CHUNK_SIZE by default
+    :return: LabeledGraph with label matrices already built
+    """
+    node_indices = dict()
+    label_indices = dict()
+    sources, targets, label_ids = [], [], []
+    with pd.read_csv(
+            path, sep=sep, header=None, names=["from", "to", "label"], engine="c", dtype=str,
+            keep_default_na=False, chunksize=chunk_size or EDGE_LIST_CHUNK_SIZE,
+    ) as reader:
+        for chunk in reader:
+            chunk_nodes = _get_global_indices(
+                np.column_stack((chunk["from"].to_numpy(), chunk["to"].to_numpy())).ravel(), node_indices,
+                integer_tokens=True,
+            )
+            sources.append(chunk_nodes[0::2])
+            targets.append(chunk_nodes[1::2])
+            label_ids.append(_get_global_indices(chunk["label"].to_numpy(), label_indices))
+
+    node_ids = list(node_indices)
+    labels = list(label_indices)
+    sources = np.concatenate(sources) if sources else np.empty(0, dtype=np.int64)
+    targets = np.concatenate(targets) if targets else np.empty(0, dtype=np.int64)
+    label_ids = np.concatenate(label_ids) if label_ids else np.empty(0, dtype=np.int64)
+    return LabeledGraph(
+        _to_value_array(node_ids), sources, targets, label_ids, _to_value_array(labels),
+        label_matrices=label_matrices_from_arrays(labels, label_ids, sources, targets, len(node_ids)),
+    )
+
+
+def _get_global_indices(values: np.ndarray, indices: Dict, integer_tokens: bool = False) -> np.ndarray:
+    """
+    Helper function to map chunk tokens to indices, extending the mapping with new values,
+    only distinct tokens of the chunk are processed in Python. With integer_tokens integer tokens
+    become int values whatever other tokens the chunk has, so the result does not depend on chunk boundaries
+    """
+    codes, uniques = pd.factorize(values)
+    mapping = np.fromiter(
+        (
+            indices.setdefault(
+                int(token) if integer_tokens and _INTEGER_TOKEN.fullmatch(token) else token, len(indices)
+            )
+            for token in uniques.tolist()
+        ),
+        dtype=np.int64,
+        count=len(uniques),
+    )
+    return mapping[codes]
+
+
+def _to_value_array(values: list) -> np.ndarray:
+    """
+    Helper function to keep values that are all strings or all integers in native numpy dtype
+    and others, e.g. mixed or tuple node ids, as objects
+    """
+    if all(isinstance(value, str) for value in values):
+        return np.array(values, dtype=str)
+    if all(isinstance(value, (int, np.integer)) and not isinstance(value, bool) for value in values):
+        return np.array(values, dtype=np.int64)
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def load_labeled_graph(graph_name: str, cache_dir=None) -> LabeledGraph:
+    """
+    Loads a graph from dataset as LabeledGraph through the local cache, see load_graph_arrays,
+    or streams it from local edge list file, see read_edge_list
+    :param graph_name: Name of the graph or path to the edge list file
+    :param cache_dir: (optional) cache directory, GRAPH_CACHE_DIR by default
+    :return: LabeledGraph
+    """
+    if os.path.isfile(graph_name):
+        return read_edge_list(graph_name)
+    return LabeledGraph.from_arrays(load_graph_arrays(graph_name, cache_dir))
 
 
 def save_graph_to_file(graph: nx.MultiDiGraph, file):
@@ -7,10 +7,10 @@ from pyformlang.finite_automaton import EpsilonNFA, State, Symbol
 from dist.qlangLexer import qlangLexer
 from dist.qlangParser import qlangParser
 from dist.qlangVisitor import qlangVisitor
-from project.g_util import read_graph_from_file, load_graph
+from project.g_util import read_graph_from_file, load_labeled_graph
 from project.matrix_util import AdjacencyMatrix, intersect_adjacency_matrices, adjacency_matrix_to_nfa, iterate_nfa, \
     concat
-from project.regex_util import graph_to_nfa, regex_string_to_min_dfa
+from project.regex_util import graph_to_nfa, regex_string_to_min_dfa, compile_regex
 
 
 class ValueType(Enum):
@@ -154,21 +154,21 @@ class InterpretVisitor(qlangVisitor):
 
     def get_reachable(self, value:ValueHolder, ctx) -> ValueHolder:
         if value.value_type is ValueType.StringValue:
-            dfa = regex_string_to_min_dfa(value.value)
+            dfa = compile_regex(value.value).dfa
         reachables = dfa._get_reachable_states()
         result = ValueHolder(value=reachables, ctx=ctx, value_type=ValueType.SetValue)
         return result
 
     def get_verices(self, value:ValueHolder, ctx) -> ValueHolder:
         if value.value_type is ValueType.StringValue:
-            dfa = regex_string_to_min_dfa(value.value)
-        reachables = dfa.states
+            dfa = compile_regex(value.value).dfa
+        reachables = set(dfa.states)
         result = ValueHolder(value=reachables, ctx=ctx, value_type=ValueType.SetValue)
         return result
 
     def get_edges(self, value:ValueHolder, ctx) -> ValueHolder:
         if value.value_type is ValueType.StringValue:
-            dfa = regex_string_to_min_dfa(value.value)
+            dfa = compile_regex(value.value).dfa
         it = iterate_nfa(dfa)
         edges = {(u, l, v) for u, l, v in it}
         result = ValueHolder(value=edges, ctx=ctx, value_type=ValueType.SetValue)
@@ -176,8 +176,8 @@ class InterpretVisitor(qlangVisitor):
 
     def get_labels(self, value:ValueHolder, ctx) -> ValueHolder:
         if value.value_type is ValueType.StringValue:
-            dfa = regex_string_to_min_dfa(value.value)
-        labels = dfa.symbols
+            dfa = compile_regex(value.value).dfa
+        labels = set(dfa.symbols)
         result = ValueHolder(value=labels, ctx=ctx, value_type=ValueType.SetValue)
         return result
 
@@ -265,7 +265,7 @@ class InterpretVisitor(qlangVisitor):
 
     def visitExpr_load(self, ctx:qlangParser.Expr_loadContext):
         self.enter_ctx(ctx)
-        g = graph_to_nfa(load_graph(eval(ctx.value.text)))
+        g = graph_to_nfa(load_labeled_graph(eval(ctx.value.text)))
         result = ValueHolder(value=g, ctx=ctx, value_type=ValueType.FiniteAutomataValue)
         self.exit_ctx()
         return result
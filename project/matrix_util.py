@@ -1,9 +1,32 @@
-from typing import Set, Iterable
+from typing import Set, Iterable, Dict, Sequence, Union, Tuple
 
+import networkx as nx
+import numpy as np
 from pyformlang.finite_automaton import NondeterministicFiniteAutomaton, State, Symbol, EpsilonNFA
 from scipy import sparse
 from scipy.sparse._compressed import _cs_matrix
 
+from project.g_util import LabeledGraph, label_matrices_from_arrays
+from project.sparse_backend import SparseBackend, get_backend
+
+
+class IterationStatistics:
+    """
+    Class representing statistics of an iterative fixpoint computation
+    """
+    def __init__(self):
+        self.iterations = 0
+        self.nnz_growth = []
+
+    def add_iteration(self, new_nnz: int):
+        """
+        Records one finished round
+        :param new_nnz: number of entries discovered in the round
+        :return: None
+        """
+        self.iterations += 1
+        self.nnz_growth.append(new_nnz)
+
 
 class AdjacencyMatrix:
     """
@@ -12,15 +35,69 @@ class AdjacencyMatrix:
     def __init__(self, nfa: NondeterministicFiniteAutomaton = None):
         if nfa is None:
             self.state_indices = dict()
+            self.index_states = np.empty(0, dtype=object)
             self.start_states = set()
             self.final_states = set()
             self.matrix = dict()
         else:
-            self.state_indices = {state: index for index, state in enumerate(nfa.states)}
+            self.set_states(list(nfa.states))
             self.start_states = nfa.start_states
             self.final_states = nfa.final_states
             self.matrix = self.create_matrix(nfa)
 
+    def set_states(self, states: Sequence):
+        """
+        Sets NFA states keeping both state -> index and index -> state lookups in sync
+        :param states: States, index of a state is its position in the sequence
+        :return: None
+        """
+        self.state_indices = {state: index for index, state in enumerate(states)}
+        self.index_states = np.fromiter(states, dtype=object, count=len(states))
+
+    def add_states(self, states: Iterable):
+        """
+        Appends states missing in the matrix, indices of existing states are kept and label matrices are resized
+        :param states: States
+        :return: None
+        """
+        new_states = [state for state in dict.fromkeys(states) if state not in self.state_indices]
+        if len(new_states) == 0:
+            return
+        for state in new_states:
+            self.state_indices[state] = len(self.state_indices)
+        self.index_states = np.concatenate(
+            (self.index_states, np.fromiter(new_states, dtype=object, count=len(new_states)))
+        )
+        self.matrix = {
+            symbol: resize_matrix(matrix, self.get_states_len()) for symbol, matrix in self.matrix.items()
+        }
+
+    def get_edge_matrices(self, edges: Iterable[Tuple], add_states: bool = True) -> Dict[Symbol, sparse.csr_matrix]:
+        """
+        Builds boolean matrix of every label of given graph edges over indices of this matrix
+        :param edges: Edges (node_from, node_to, label) as in graph.edges(data="label")
+        :param add_states: add nodes missing in the matrix as new states first, otherwise skip their edges
+        :return: dictionary label -> boolean csr matrix
+        """
+        if add_states:
+            edges = list(edges)
+            self.add_states(State(node) for node_from, node_to, _ in edges for node in (node_from, node_to))
+        else:
+            edges = [
+                edge for edge in edges if State(edge[0]) in self.state_indices and State(edge[1]) in self.state_indices
+            ]
+        labels = dict()
+        rows = np.empty(len(edges), dtype=np.int64)
+        cols = np.empty(len(edges), dtype=np.int64)
+        label_ids = np.empty(len(edges), dtype=np.int64)
+        for i, (node_from, node_to, label) in enumerate(edges):
+            rows[i] = self.state_indices[State(node_from)]
+            cols[i] = self.state_indices[State(node_to)]
+            label_ids[i] = labels.setdefault(label, len(labels))
+        return label_matrices_from_arrays(
+            [Symbol(label) for label in labels], label_ids, rows, cols, self.get_states_len()
+        )
+
     def get_states_len(self):
         """
         :return: number of NFA states
@@ -51,70 +128,335 @@ class AdjacencyMatrix:
         :param nfa: NFA
         :return: transitive closure dictionary
         """
-        matrix = dict()
-        nfa_dictionary = nfa.to_dict()
-        states_length = self.get_states_len()
+        labels = dict()
+        rows, cols, label_ids = [], [], []
 
-        for state_from, transition in nfa_dictionary.items():
+        for state_from, transition in nfa.to_dict().items():
+            index_from = self.state_indices[state_from]
             for label, states_to in transition.items():
                 if not isinstance(states_to, set):
                     states_to = {states_to}
 
+                label_id = labels.setdefault(label, len(labels))
                 for state_to in states_to:
-                    index_from = self.state_indices[state_from]
-                    index_to = self.state_indices[state_to]
-                    if label not in matrix:
-                        matrix[label] = sparse.csr_matrix((states_length, states_length), dtype=bool)
-                    matrix[label][index_from, index_to] = True
-        return matrix
+                    rows.append(index_from)
+                    cols.append(self.state_indices[state_to])
+                    label_ids.append(label_id)
+
+        return label_matrices_from_arrays(
+            list(labels.keys()),
+            np.array(label_ids, dtype=np.int64),
+            np.array(rows, dtype=np.int64),
+            np.array(cols, dtype=np.int64),
+            self.get_states_len(),
+        )
+
+    @staticmethod
+    def from_graph(
+            graph: Union[nx.MultiDiGraph, LabeledGraph], start_nodes: Iterable = None, final_nodes: Iterable = None
+    ):
+        """
+        Creates Adjacency Matrix straight from the labeled graph, skipping the intermediate NFA
+        :param graph: Graph with "label" attribute on edges or LabeledGraph
+        :param start_nodes: (optional) nodes to be used as start states, all nodes by default
+        :param final_nodes: (optional) nodes to be used as final states, all nodes by default
+        :return: Adjacency Matrix equivalent to AdjacencyMatrix(graph_to_nfa(graph, start_nodes, final_nodes))
+        """
+        nodes = list(graph.nodes)
+        start_nodes = nodes if start_nodes is None else list(start_nodes)
+        final_nodes = nodes if final_nodes is None else list(final_nodes)
+
+        node_indices = {node: index for index, node in enumerate(nodes)}
+        for node in (*start_nodes, *final_nodes):
+            node_indices.setdefault(node, len(node_indices))
+
+        result = AdjacencyMatrix()
+        result.set_states([State(node) for node in node_indices])
+        result.start_states = {State(node) for node in start_nodes}
+        result.final_states = {State(node) for node in final_nodes}
+
+        if isinstance(graph, LabeledGraph):
+            if len(node_indices) == len(nodes):
+                label_matrices = graph.get_label_matrices()
+            else:
+                label_matrices = label_matrices_from_arrays(
+                    graph.labels.tolist(), graph.label_ids, graph.sources, graph.targets, len(node_indices)
+                )
+            result.matrix = {Symbol(label): matrix for label, matrix in label_matrices.items()}
+            return result
+
+        labels = dict()
+        edges_count = graph.number_of_edges()
+        rows = np.empty(edges_count, dtype=np.int64)
+        cols = np.empty(edges_count, dtype=np.int64)
+        label_ids = np.empty(edges_count, dtype=np.int64)
+        for i, (node_from, node_to, label) in enumerate(graph.edges(data="label")):
+            rows[i] = node_indices[node_from]
+            cols[i] = node_indices[node_to]
+            label_ids[i] = labels.setdefault(label, len(labels))
+
+        result.matrix = label_matrices_from_arrays(
+            [Symbol(label) for label in labels], label_ids, rows, cols, len(node_indices)
+        )
+        return result
 
-    def get_transitive_closure(self) -> _cs_matrix:
+    def get_transitive_closure(
+            self, statistics: IterationStatistics = None, backend: Union[str, SparseBackend] = None
+    ) -> _cs_matrix:
         """
+        :param statistics: (optional) collects number of rounds and entries discovered per round
+        :param backend: (optional) SparseBackend or its name running the products, scipy by default
         :return: Transitive closure. Return type is the most generic scipy type for sparce matrices
         """
-        result = sum(self.matrix.values())
-        curr_nnz = 0
-        prev_nnz = result.nnz
-
-        while prev_nnz != curr_nnz:
-            result += result.__matmul__(result)
-            prev_nnz = curr_nnz
-            curr_nnz = result.nnz
-
-        return result
+        states_length = self.get_states_len()
+        result = sparse.csr_matrix((states_length, states_length), dtype=bool)
+        for matrix in self.matrix.values():
+            result += matrix
+        return transitive_closure(result, statistics, backend=backend)
 
     def index_by_state(self, state):
         return self.state_indices[state]
 
     def state_by_index(self, index):
-        for state, ind in self.state_indices.items():
-            if ind == index:
-                return state
+        return self.index_states[index]
+
+    def get_state_values(self) -> np.ndarray:
+        """
+        :return: array of values of states in index order, e.g. graph node ids for matrices built from graphs
+        """
+        return np.fromiter((state.value for state in self.index_states), dtype=object, count=self.get_states_len())
+
+    def indices_by_states(self, states: Iterable) -> np.ndarray:
+        """
+        :param states: NFA states
+        :return: array of indices of given states
+        """
+        return np.fromiter((self.state_indices[state] for state in states), dtype=np.int64)
+
+    def states_by_indices(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Translates array of indices back to states in one vectorized lookup
+        :param indices: array of state indices
+        :return: array of states with the same shape as indices
+        """
+        return self.index_states[indices]
 
 
-def intersect_adjacency_matrices(first: AdjacencyMatrix, second: AdjacencyMatrix) -> AdjacencyMatrix:
+def resize_matrix(matrix: _cs_matrix, size: int) -> sparse.csr_matrix:
     """
-    Calculates multiplication of two adjacency matrices
-    :return: Intersected Adjacency Matrix
+    Grows square matrix to size x size without copying its entries, new rows and columns are empty
+    :param matrix: Square csr matrix
+    :param size: New size, not less than the current one
+    :return: new csr matrix sharing entries with matrix
     """
-    result = AdjacencyMatrix()
-    common_symbols = first.matrix.keys().__and__(second.matrix.keys())
+    matrix = sparse.csr_matrix(matrix)
+    indptr = np.concatenate((matrix.indptr, np.full(size - matrix.shape[0], matrix.indptr[-1])))
+    return sparse.csr_matrix((matrix.data, matrix.indices, indptr), shape=(size, size))
 
-    for symbol in common_symbols:
-        result.matrix[symbol] = sparse.kron(first.matrix[symbol], second.matrix[symbol], format="csr")
 
-    for state_first, state_first_index in first.state_indices.items():
-        for state_second, state_second_index in second.state_indices.items():
-            new_state_index = state_first_index * second.get_states_len() + state_second_index
-            new_state = new_state_index
-            result.state_indices[new_state] = new_state_index
+def transitive_closure(
+        matrix: _cs_matrix, statistics: IterationStatistics = None, closed: _cs_matrix = None,
+        backend: Union[str, SparseBackend] = None
+) -> sparse.csr_matrix:
+    """
+    Calculates transitive closure by repeated squaring with semi-naive evaluation:
+    every round multiplies only the entries discovered in the previous round (delta)
+    with the accumulated result, as products of older entries are already included.
+    All products stay in the boolean semiring
+    :param matrix: Square boolean matrix
+    :param statistics: (optional) collects number of rounds and entries discovered per round
+    :param closed: (optional) already transitively closed matrix, closure of closed + matrix is calculated
+    incrementally by treating only entries of matrix missing in closed as delta
+    :param backend: (optional) SparseBackend or its name running the products, scipy by default
+    :return: Transitive closure of matrix
+    """
+    backend = get_backend(backend)
+    if closed is None:
+        result = backend.from_scipy(matrix)
+        delta = result
+    else:
+        closed = backend.from_scipy(closed)
+        delta = backend.subtract(backend.from_scipy(matrix), closed)
+        result = backend.add(closed, delta)
+
+    while backend.nnz(delta) != 0:
+        if delta is result:
+            delta = backend.mxm(result, result, exclude=result)
+        else:
+            delta = backend.subtract(
+                backend.add(backend.mxm(delta, result), backend.mxm(result, delta)), result
+            )
+        result = backend.add(result, delta)
+        if statistics is not None:
+            statistics.add_iteration(backend.nnz(delta))
 
-            if state_first in first.start_states and state_second in second.start_states:
-                result.start_states.add(new_state)
+    return backend.to_scipy(result)
 
-            if state_first in first.final_states and state_second in second.final_states:
-                result.final_states.add(new_state)
-    return result
+
+class KroneckerAdjacencyMatrix:
+    """
+    Class representing intersection of two Adjacency Matrices as a lazy Kronecker product.
+    State with index i of the first matrix and index j of the second one has index
+    i * second.get_states_len() + j, same as in intersect_adjacency_matrices.
+    Sets of product states are stored as fronts: boolean matrices of shape
+    (second.get_states_len(), first.get_states_len()) with True at [j, i]
+    """
+    def __init__(self, first: AdjacencyMatrix, second: AdjacencyMatrix):
+        self.first = first
+        self.second = second
+        self.symbols = first.matrix.keys().__and__(second.matrix.keys())
+        self.start_indices = _product_indices(
+            first.indices_by_states(first.start_states), second.indices_by_states(second.start_states), second
+        )
+        self.final_indices = _product_indices(
+            first.indices_by_states(first.final_states), second.indices_by_states(second.final_states), second
+        )
+        self._first_transposed = None
+
+    def get_states_len(self):
+        """
+        :return: number of product states
+        """
+        return self.first.get_states_len() * self.second.get_states_len()
+
+    def state_by_index(self, index):
+        """
+        :param index: product state index
+        :return: pair of states of the first and the second matrix
+        """
+        first_index, second_index = divmod(index, self.second.get_states_len())
+        return self.first.state_by_index(first_index), self.second.state_by_index(second_index)
+
+    def get_front(self, indices: np.ndarray) -> sparse.csr_matrix:
+        """
+        :param indices: product state indices
+        :return: front containing given states
+        """
+        first_indices, second_indices = np.divmod(np.asarray(indices, dtype=np.int64), self.second.get_states_len())
+        return sparse.csr_matrix(
+            (np.ones(len(first_indices), dtype=bool), (second_indices, first_indices)),
+            shape=(self.second.get_states_len(), self.first.get_states_len()),
+            dtype=bool,
+        )
+
+    def front_to_indices(self, front: _cs_matrix) -> np.ndarray:
+        """
+        :param front: front of product states
+        :return: sorted product state indices contained in front
+        """
+        second_indices, first_indices = front.nonzero()
+        return np.sort(first_indices.astype(np.int64) * self.second.get_states_len() + second_indices)
+
+    def step(self, front: _cs_matrix) -> sparse.csr_matrix:
+        """
+        Makes one transition from every state of front without materializing the Kronecker product:
+        for every common symbol second^T . front . first is added to the result
+        :param front: front of product states
+        :return: front of states reachable in exactly one transition
+        """
+        result = sparse.csr_matrix(front.shape, dtype=bool)
+        for symbol in self.symbols:
+            result += self.second.matrix[symbol].T @ (front @ self.first.matrix[symbol])
+        return result
+
+    def step_back(self, front: _cs_matrix) -> sparse.csr_matrix:
+        """
+        Makes one transition backwards from every state of front, over reversed second matrix
+        and transposed first matrix: for every common symbol second . front . first^T is added to the result
+        :param front: front of product states
+        :return: front of states from which some state of front is reachable in exactly one transition
+        """
+        if self._first_transposed is None:
+            self._first_transposed = {symbol: self.first.matrix[symbol].T.tocsr() for symbol in self.symbols}
+        result = sparse.csr_matrix(front.shape, dtype=bool)
+        for symbol in self.symbols:
+            result += self.second.matrix[symbol] @ (front @ self._first_transposed[symbol])
+        return result
+
+    def has_reachable_final(self, bidirectional: bool = True) -> bool:
+        """
+        Checks if any final state is reachable from any start state, stopping at the first found one.
+        Bidirectional search also goes backwards from final states, expanding the smaller of the two fronts,
+        and stops as soon as they meet
+        :param bidirectional: search from both sides, only forwards otherwise
+        :return: True if some final state is reachable
+        """
+        front = self.get_front(self.start_indices)
+        back_front = self.get_front(self.final_indices)
+        visited, back_visited = front, back_front
+        if front.multiply(back_front).nnz != 0:
+            return True
+
+        while front.nnz != 0 and back_front.nnz != 0:
+            if not bidirectional or front.nnz <= back_front.nnz:
+                front = self.step(front) > visited
+                if front.multiply(back_visited).nnz != 0:
+                    return True
+                visited = visited + front
+            else:
+                back_front = self.step_back(back_front) > back_visited
+                if back_front.multiply(visited).nnz != 0:
+                    return True
+                back_visited = back_visited + back_front
+        return False
+
+    def get_reachable(self, front: _cs_matrix = None) -> sparse.csr_matrix:
+        """
+        :param front: (optional) front to start from, start states by default
+        :return: front of states reachable from the given ones, including themselves
+        """
+        if front is None:
+            front = self.get_front(self.start_indices)
+        visited = sparse.csr_matrix(front, dtype=bool, copy=True)
+
+        while front.nnz != 0:
+            front = self.step(front) > visited
+            visited = visited + front
+
+        return visited
+
+    def to_adjacency_matrix(self, backend: Union[str, SparseBackend] = None) -> AdjacencyMatrix:
+        """
+        Materializes the Kronecker product
+        :param backend: (optional) SparseBackend or its name running the products, scipy by default
+        :return: Intersected Adjacency Matrix
+        """
+        backend = get_backend(backend)
+        result = AdjacencyMatrix()
+        result.set_states(range(self.get_states_len()))
+        for symbol in self.symbols:
+            result.matrix[symbol] = backend.to_scipy(backend.kron(
+                backend.from_scipy(self.first.matrix[symbol]), backend.from_scipy(self.second.matrix[symbol])
+            ))
+        result.start_states = set(self.start_indices.tolist())
+        result.final_states = set(self.final_indices.tolist())
+        return result
+
+
+def _product_indices(first_indices: np.ndarray, second_indices: np.ndarray, second: AdjacencyMatrix) -> np.ndarray:
+    """
+    Helper function to get indices of all product states built from given state indices
+    """
+    return (first_indices[:, None] * second.get_states_len() + second_indices[None, :]).ravel()
+
+
+def intersect_adjacency_matrices_lazy(first: AdjacencyMatrix, second: AdjacencyMatrix) -> KroneckerAdjacencyMatrix:
+    """
+    Calculates intersection of two adjacency matrices without materializing Kronecker products
+    :return: Lazy Intersected Adjacency Matrix
+    """
+    return KroneckerAdjacencyMatrix(first, second)
+
+
+def intersect_adjacency_matrices(
+        first: AdjacencyMatrix, second: AdjacencyMatrix, backend: Union[str, SparseBackend] = None
+) -> AdjacencyMatrix:
+    """
+    Calculates multiplication of two adjacency matrices
+    :param backend: (optional) SparseBackend or its name running the products, scipy by default
+    :return: Intersected Adjacency Matrix
+    """
+    return KroneckerAdjacencyMatrix(first, second).to_adjacency_matrix(backend)
 
 
 def adjacency_matrix_to_nfa(am: AdjacencyMatrix) -> NondeterministicFiniteAutomaton:
@@ -136,36 +478,52 @@ def adjacency_matrix_to_nfa(am: AdjacencyMatrix) -> NondeterministicFiniteAutoma
     return nfa
 
 
-def _get_front(first_matrix: AdjacencyMatrix, second_matrix: AdjacencyMatrix, start_state_indices) -> _cs_matrix:
+def _get_front(first_matrix: AdjacencyMatrix, second_matrix: AdjacencyMatrix, start_state_indices: np.ndarray) -> _cs_matrix:
     """
-    Helper function to get front row matrx
+    Helper function to get block front matrix: one block of second_matrix.get_states_len() rows per start index,
+    block b has True at rows of second_matrix start states in column start_state_indices[b]
     """
-    front_row_matrix = sparse.dok_matrix((1, first_matrix.get_states_len()), dtype=bool)
+    second_length = second_matrix.get_states_len()
+    second_start_indices = second_matrix.indices_by_states(second_matrix.start_states)
+    blocks = np.arange(len(start_state_indices))
+
+    rows = (blocks[:, None] * second_length + second_start_indices[None, :]).ravel()
+    cols = np.repeat(np.asarray(start_state_indices, dtype=np.int64), len(second_start_indices))
+    return sparse.csr_matrix(
+        (np.ones(len(rows), dtype=bool), (rows, cols)),
+        shape=(len(blocks) * second_length, first_matrix.get_states_len()),
+        dtype=bool,
+    )
 
-    for i in start_state_indices:
-        front_row_matrix[0, i] = True
-    front_row_matrix = front_row_matrix.tocsr()
 
-    front = sparse.csr_matrix((second_matrix.get_states_len(), first_matrix.get_states_len()), dtype=bool)
-    for i in map(lambda state: second_matrix.index_by_state(state), second_matrix.start_states):
-        front[i, :] = front_row_matrix
-    return front
+def _get_transition_operators(second_matrix: AdjacencyMatrix, symbols: Iterable, blocks: int) -> Dict[Symbol, _cs_matrix]:
+    """
+    Helper function to get block diagonal operators moving front rows along second_matrix transitions:
+    row i of every block is added to row j of the same block for every transition (i, j) by the symbol
+    """
+    identity = sparse.identity(blocks, dtype=bool, format="csr")
+    return {
+        symbol: sparse.kron(identity, second_matrix.matrix[symbol].T, format="csr")
+        for symbol in symbols
+    }
 
 
-def _get_reachable_states(first_matrix: AdjacencyMatrix, second_matrix: AdjacencyMatrix, sub_front_indices, visited) -> Set[State]:
+def _get_reachable_states(first_matrix: AdjacencyMatrix, second_matrix: AdjacencyMatrix, visited) -> tuple[np.ndarray, np.ndarray]:
     """
     Helper function to get all reachable indices
+    :return: block numbers and first_matrix final state indices reachable in that block, as two parallel arrays
     """
-    sub_front_offset = sub_front_indices * second_matrix.get_states_len()
-    reachable = sparse.csr_matrix((1, first_matrix.get_states_len()), dtype=bool)
-    for i in map(lambda state: second_matrix.index_by_state(state), second_matrix.final_states):
-        reachable += visited[sub_front_offset + i, :]
+    second_length = second_matrix.get_states_len()
+    second_final_mask = np.zeros(second_length, dtype=bool)
+    second_final_mask[second_matrix.indices_by_states(second_matrix.final_states)] = True
+    first_final_mask = np.zeros(first_matrix.get_states_len(), dtype=bool)
+    first_final_mask[first_matrix.indices_by_states(first_matrix.final_states)] = True
+
+    rows, cols = visited.nonzero()
+    accepted = second_final_mask[rows % second_length] & first_final_mask[cols]
+    pairs = np.unique(np.stack([rows[accepted] // second_length, cols[accepted]]).astype(np.int64), axis=1)
+    return pairs[0], pairs[1]
 
-    return set(
-        first_matrix.state_by_index(i)
-        for i in reachable.nonzero()[1]
-        if i in map(lambda state: first_matrix.index_by_state(state), first_matrix.final_states)
-    )
 
 def iterate_nfa(fa: EpsilonNFA) -> Iterable[tuple[State, Symbol, State]]:
     for u, t in fa.to_dict().items():
@@ -1,17 +1,59 @@
-from typing import Set
+from typing import Set, NamedTuple
 
 import networkx as nx
 from pyformlang.regular_expression import Regex
 from pyformlang.finite_automaton import DeterministicFiniteAutomaton, NondeterministicFiniteAutomaton
 
+from project.cache_util import CompilationCache
+from project.matrix_util import AdjacencyMatrix
+
+
+class CompiledRegex(NamedTuple):
+    """
+    Represents regex compiled to minimal DFA and its Adjacency Matrix,
+    both are shared through REGEX_CACHE and must not be mutated
+    """
+    text: str
+    dfa: DeterministicFiniteAutomaton
+    matrix: AdjacencyMatrix
+
+
+REGEX_CACHE = CompilationCache(maxsize=256)
+
+
+def normalize_regex_string(regex_string: str) -> str:
+    """
+    Normalizes regex text, so that spellings differing only in whitespace share cache entry
+    :param regex_string: Regex text
+    :return: Regex text with whitespace runs collapsed to single spaces
+    """
+    return " ".join(regex_string.split())
+
+
+def compile_regex(regex_string: str, cache: CompilationCache = None) -> CompiledRegex:
+    """
+    Compiles regex string to minimal DFA and Adjacency Matrix through the cache
+    :param regex_string: Regex text
+    :param cache: (optional) cache to use, REGEX_CACHE by default
+    :return: CompiledRegex shared with other callers
+    """
+    text = normalize_regex_string(regex_string)
+    cache = REGEX_CACHE if cache is None else cache
+
+    def compile_value():
+        dfa = Regex(text).to_epsilon_nfa().minimize()
+        return CompiledRegex(text, dfa, AdjacencyMatrix(dfa))
+
+    return cache.get(("regex", text), compile_value)
+
 
 def regex_string_to_min_dfa(regex_string: str) -> DeterministicFiniteAutomaton:
     """
     Create DFA based on the regex string
     :param regex_str: DFA will be created based on this Regex
-    :return: DFA
+    :return: DFA, a fresh copy of the cached one that can be modified
     """
-    return Regex(regex_string).to_epsilon_nfa().minimize()
+    return compile_regex(regex_string).dfa.copy()
 
 def regex_to_min_dfa(regex: Regex) -> DeterministicFiniteAutomaton:
     """
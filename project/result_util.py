@@ -0,0 +1,103 @@
+from typing import Iterable, Iterator, Tuple, Set
+
+import numpy as np
+from scipy import sparse
+
+
+class NodePairs:
+    """
+    Class representing set of node pairs backed by boolean csr matrix over node indices.
+    Pairs are decoded to node ids only on iteration, so large answers stay compact
+    """
+    def __init__(self, matrix: sparse.spmatrix, nodes: np.ndarray):
+        """
+        :param matrix: Square boolean matrix, entry [i, j] means pair (nodes[i], nodes[j]) is present
+        :param nodes: Node ids in matrix index order
+        """
+        self.matrix = sparse.csr_matrix(matrix, dtype=bool)
+        self.matrix.eliminate_zeros()
+        self.matrix.sort_indices()
+        self.nodes = nodes
+        self._node_indices = None
+
+    @staticmethod
+    def from_index_arrays(sources: np.ndarray, targets: np.ndarray, nodes: np.ndarray):
+        """
+        Creates NodePairs from paired index arrays, duplicated pairs are merged
+        :param sources: Indices of first nodes of pairs
+        :param targets: Indices of second nodes of pairs
+        :param nodes: Node ids in index order
+        :return: NodePairs
+        """
+        return NodePairs(
+            sparse.csr_matrix(
+                (np.ones(len(sources), dtype=bool), (sources, targets)), shape=(len(nodes), len(nodes)), dtype=bool
+            ),
+            nodes,
+        )
+
+    @staticmethod
+    def from_pairs(pairs: Iterable[Tuple], nodes: np.ndarray):
+        """
+        Creates NodePairs from pairs of node ids
+        :param pairs: Pairs of node ids, every node must be in nodes
+        :param nodes: Node ids in index order
+        :return: NodePairs
+        """
+        node_indices = {node: index for index, node in enumerate(nodes)}
+        indices = np.array([(node_indices[u], node_indices[v]) for u, v in pairs], dtype=np.int64).reshape(-1, 2)
+        return NodePairs.from_index_arrays(indices[:, 0], indices[:, 1], nodes)
+
+    def get_index_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: paired int64 arrays of node indices of all pairs
+        """
+        sources, targets = self.matrix.nonzero()
+        return sources.astype(np.int64), targets.astype(np.int64)
+
+    def get_node_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: paired arrays of node ids of all pairs
+        """
+        sources, targets = self.get_index_arrays()
+        return self.nodes[sources], self.nodes[targets]
+
+    def to_set(self) -> Set[Tuple]:
+        """
+        :return: Python set of all pairs
+        """
+        return set(zip(*self.get_node_arrays()))
+
+    def __len__(self):
+        return self.matrix.nnz
+
+    def __iter__(self) -> Iterator[Tuple]:
+        indptr, indices = self.matrix.indptr, self.matrix.indices
+        for row in np.flatnonzero(np.diff(indptr)):
+            source = self.nodes[row]
+            for col in indices[indptr[row]:indptr[row + 1]]:
+                yield source, self.nodes[col]
+
+    def __contains__(self, pair) -> bool:
+        if self._node_indices is None:
+            self._node_indices = {node: index for index, node in enumerate(self.nodes)}
+        try:
+            source, target = pair
+            row, col = self._node_indices[source], self._node_indices[target]
+        except (KeyError, TypeError, ValueError):
+            return False
+        row_indices = self.matrix.indices[self.matrix.indptr[row]:self.matrix.indptr[row + 1]]
+        position = np.searchsorted(row_indices, col)
+        return position < len(row_indices) and row_indices[position] == col
+
+    def __eq__(self, other):
+        if isinstance(other, NodePairs):
+            return self.to_set() == other.to_set()
+        if isinstance(other, (set, frozenset)):
+            return len(self) == len(other) and all(pair in self for pair in other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"NodePairs({len(self)} pairs)"
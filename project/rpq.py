@@ -1,126 +1,684 @@
-from typing import Set, Dict, Iterable
+import copy
+from concurrent.futures import ProcessPoolExecutor
+from typing import Set, Dict, Iterable, Iterator, Tuple, Union, List
 
+import numpy as np
 from scipy import sparse
 import networkx as nx
+from pyformlang.finite_automaton import State
 
 import project.regex_util as regex_util
-from project.matrix_util import AdjacencyMatrix, intersect_adjacency_matrices, _get_front, _get_reachable_states
+from project.matrix_util import AdjacencyMatrix, intersect_adjacency_matrices_lazy, _get_front, \
+    _get_reachable_states, _get_transition_operators, _product_indices, resize_matrix, transitive_closure
+from project.result_util import NodePairs
+from project.sparse_backend import SparseBackend
 
 
-def rpq_to_graph_tc(graph: nx.MultiDiGraph, query: str, start_nodes: set = None, final_nodes: set = None) -> set:
+def rpq_to_graph_tc(
+        graph: Union[nx.MultiDiGraph, "PreparedGraph"], query: str, start_nodes: set = None, final_nodes: set = None,
+        sparse_result: bool = False, backend: Union[str, SparseBackend] = None
+) -> Union[set, NodePairs]:
     """
     Calculates Regular Path Querying (RPQ) for graph and regular expression with transitive closure method
-    :param graph: Graph to send query to
+    :param graph: Graph to send query to or PreparedGraph
     :param query: Regular Expression to query
     :param start_nodes: Set of start nodes
     :param final_nodes: Set of final nodes
+    :param sparse_result: return NodePairs backed by sparse matrix instead of Python set
+    :param backend: (optional) SparseBackend or its name running Kronecker product and closure, scipy by default
     :return: Regular Path Query as set
     """
-    nfa = regex_util.graph_to_nfa(graph, start_nodes, final_nodes)
-    dfa = regex_util.regex_string_to_min_dfa(query)
-    graph_matrix = AdjacencyMatrix(nfa)
-    query_matrix = AdjacencyMatrix(dfa)
-    intersected_matrix = intersect_adjacency_matrices(graph_matrix, query_matrix)
-    transitive_closure = intersected_matrix.get_transitive_closure()
-    start_states = intersected_matrix.start_states
-    final_states = intersected_matrix.final_states
-
-    result = set()
-    for state_from, state_to in zip(*transitive_closure.nonzero()):
-        if state_from in start_states and state_to in final_states:
-            result.add((state_from // query_matrix.get_states_len(), state_to // query_matrix.get_states_len()))
-    return result
+    graph_matrix = _get_graph_matrix(graph, start_nodes, final_nodes)
+    query_matrix = regex_util.compile_regex(query).matrix
+    lazy_intersected_matrix = intersect_adjacency_matrices_lazy(graph_matrix, query_matrix)
+    transitive_closure = lazy_intersected_matrix.to_adjacency_matrix(backend).get_transitive_closure(backend=backend)
+
+    start_indices = np.unique(lazy_intersected_matrix.start_indices)
+    final_indices = np.unique(lazy_intersected_matrix.final_indices)
+    answer = transitive_closure[start_indices][:, final_indices]
+    rows, cols = answer.nonzero()
+
+    result = NodePairs.from_index_arrays(
+        start_indices[rows] // query_matrix.get_states_len(),
+        final_indices[cols] // query_matrix.get_states_len(),
+        graph_matrix.get_state_values(),
+    )
+    return result if sparse_result else result.to_set()
 
 
 def rpq_to_graph_bfs(
-        graph: nx.MultiDiGraph, query: str, start_nodes: Iterable[int] = None, final_nodes: Iterable[int] = None
-) -> Set[int]:
+        graph: Union[nx.MultiDiGraph, "PreparedGraph"], query: str, start_nodes: Iterable[int] = None, final_nodes: Iterable[int] = None,
+        sparse_result: bool = False
+) -> Union[Set[int], np.ndarray]:
     """
     Calculates Regular Path Querying (RPQ) for graph and regular expression with BFS method
-    :param graph: Graph to send query to
+    :param graph: Graph to send query to or PreparedGraph
     :param query: Regular Expression to query
     :param start_nodes: Set of start nodes
     :param final_nodes: Set of final nodes
-    :return: Regular Path Querying in Set format
+    :param sparse_result: return NumPy array of nodes instead of Python set
+    :return: Final nodes reachable from any of the start nodes
     """
+    graph_matrix = _get_graph_matrix(graph, start_nodes, final_nodes)
+    query_matrix = regex_util.compile_regex(query).matrix
+    intersected_matrix = intersect_adjacency_matrices_lazy(graph_matrix, query_matrix)
+    visited_matrix = intersected_matrix.get_reachable()
 
-    nfa = regex_util.graph_to_nfa(graph, start_nodes, final_nodes)
-    dfa = regex_util.regex_string_to_min_dfa(query)
-    graph_matrix = AdjacencyMatrix(nfa)
-    query_matrix = AdjacencyMatrix(dfa)
-    symbols = graph_matrix.matrix.keys().__and__(query_matrix.matrix.keys())
-    front = (
-        sparse.vstack(
-            [_get_front(graph_matrix, query_matrix, {i}) for i in map(lambda state: graph_matrix.index_by_state(state), graph_matrix.start_states)]
-        )
-    )
-    visited_matrix = front
-
-    while True:
-        new_front = sparse.csr_matrix(front.shape, dtype=bool)
-        for label in symbols:
-            next_front_part = front.__matmul__(graph_matrix.matrix[label])
-            for (i, j) in zip(*query_matrix.matrix[label].nonzero()):
-                new_front[ j, :] += next_front_part[ i, :]
-
-        front = new_front > visited_matrix
-        visited_matrix += front
+    _, ends = _get_reachable_states(graph_matrix, query_matrix, visited_matrix)
+    if sparse_result:
+        return graph_matrix.get_state_values()[np.unique(ends)]
+    return {end.value for end in graph_matrix.states_by_indices(ends)}
 
-        if front.count_nonzero() == 0:
-            break
 
-    result = _get_reachable_states(graph_matrix, query_matrix, 0, visited_matrix)
-    return {end.value for end in result}
+def rpq_path_exists(
+        graph: Union[nx.MultiDiGraph, "PreparedGraph"], query: str, start_nodes: Iterable[int] = None,
+        final_nodes: Iterable[int] = None, bidirectional: bool = True
+) -> bool:
+    """
+    Checks if any of the final nodes is reachable from any of the start nodes by a path matching regular expression,
+    same as bool(rpq_to_graph_bfs(...)) but exiting on the first accepting pair. Bidirectional search also explores
+    backwards from the final nodes over the reversed DFA and transposed label matrices until the fronts meet,
+    which suits point-to-point queries
+    :param graph: Graph to send query to or PreparedGraph
+    :param query: Regular Expression to query
+    :param start_nodes: Set of start nodes
+    :param final_nodes: Set of final nodes
+    :param bidirectional: search from both start and final nodes, only forwards otherwise
+    :return: True if some final node is reachable
+    """
+    graph_matrix = _get_graph_matrix(graph, start_nodes, final_nodes)
+    query_matrix = regex_util.compile_regex(query).matrix
+    return intersect_adjacency_matrices_lazy(graph_matrix, query_matrix).has_reachable_final(bidirectional)
 
 
 def rpq_to_graph_bfs_all_reachable(
-        graph: nx.MultiDiGraph, query: str, start_nodes: Iterable[int] = None, final_nodes: Iterable[int] = None
-) -> Dict[int, Set[int]]:
+        graph: Union[nx.MultiDiGraph, "PreparedGraph"], query: str, start_nodes: Iterable[int] = None, final_nodes: Iterable[int] = None,
+        chunk_size: int = None, workers: int = None, sparse_result: bool = False
+) -> Union[Dict[int, Set[int]], NodePairs]:
     """
     Calculates Regular Path Querying (RPQ) for graph and regular expression with BFS method
-    :param graph: Graph to send query to
+    :param graph: Graph to send query to or PreparedGraph
     :param query: Regular Expression to query
     :param start_nodes: Set of start nodes
     :param final_nodes: Set of final nodes
+    :param chunk_size: (optional) number of start nodes processed at once, all of them by default
+    :param workers: (optional) number of worker processes, chunks are processed in this process by default
+    :param sparse_result: return NodePairs of (start, end) backed by sparse matrix instead of Python dictionary
     :return: Regular Path Querying in Dictionary format
     """
+    if sparse_result:
+        graph_matrix = _get_graph_matrix(graph, start_nodes, final_nodes)
+        sources, targets = [], []
+        for start_indices, (blocks, ends) in _iterate_chunks(graph_matrix, query, chunk_size, workers):
+            sources.append(start_indices[blocks])
+            targets.append(ends)
+        return NodePairs.from_index_arrays(
+            np.concatenate(sources or [np.empty(0, dtype=np.int64)]),
+            np.concatenate(targets or [np.empty(0, dtype=np.int64)]),
+            graph_matrix.get_state_values(),
+        )
+
+    result = dict()
+    for chunk_result in rpq_to_graph_bfs_all_reachable_chunks(
+            graph, query, start_nodes, final_nodes, chunk_size, workers
+    ):
+        result.update(chunk_result)
+    return result
+
+
+def rpq_to_graph_bfs_all_reachable_chunks(
+        graph: Union[nx.MultiDiGraph, "PreparedGraph"], query: str, start_nodes: Iterable[int] = None, final_nodes: Iterable[int] = None,
+        chunk_size: int = None, workers: int = None
+) -> Iterator[Dict[int, Set[int]]]:
+    """
+    Calculates Regular Path Querying (RPQ) with BFS method processing start nodes in chunks,
+    so peak memory is bounded by chunk_size * |Q| * |V| instead of growing with the number of start nodes
+    :param graph: Graph to send query to or PreparedGraph
+    :param query: Regular Expression to query
+    :param start_nodes: Set of start nodes
+    :param final_nodes: Set of final nodes
+    :param chunk_size: (optional) number of start nodes processed at once, all of them by default
+    :param workers: (optional) number of worker processes, chunks are processed in this process by default
+    :return: Iterator of Regular Path Querying results in Dictionary format, one per chunk
+    """
+    graph_matrix = _get_graph_matrix(graph, start_nodes, final_nodes)
+    for start_indices, (blocks, ends) in _iterate_chunks(graph_matrix, query, chunk_size, workers):
+        starts = graph_matrix.states_by_indices(start_indices)
+        result = {start.value: set() for start in starts}
+        for start, end in zip(starts[blocks], graph_matrix.states_by_indices(ends)):
+            result[start.value].add(end.value)
+        yield result
+
+
+def rpq_to_graph_bfs_batch(
+        graph: Union[nx.MultiDiGraph, "PreparedGraph"], queries: Iterable[str], start_nodes: Iterable[int] = None,
+        final_nodes: Iterable[int] = None
+) -> Dict[str, Set[int]]:
+    """
+    Calculates rpq_to_graph_bfs for many regular expressions at once: DFAs of all queries are united
+    into one automaton with final states tagged by query, so a single BFS multiplies every front by every
+    graph label matrix once for the whole batch instead of once per query
+    :param graph: Graph to send queries to or PreparedGraph
+    :param queries: Regular Expressions to query
+    :param start_nodes: Set of start nodes
+    :param final_nodes: Set of final nodes
+    :return: dictionary query -> final nodes reachable from any of the start nodes
+    """
+    queries = list(dict.fromkeys(queries))
+    if len(queries) == 0:
+        return dict()
+    graph_matrix = _get_graph_matrix(graph, start_nodes, final_nodes)
+    union_matrix, tags = _get_union_query_matrix(queries)
+    visited_matrix = intersect_adjacency_matrices_lazy(graph_matrix, union_matrix).get_reachable()
+
+    query_ids, _, ends = _get_tagged_reachable_states(graph_matrix, union_matrix, tags, visited_matrix)
+    nodes = graph_matrix.get_state_values()
+    result = {query: set() for query in queries}
+    for query_id, end in zip(query_ids.tolist(), nodes[ends]):
+        result[queries[query_id]].add(end)
+    return result
+
+
+def rpq_to_graph_bfs_all_reachable_batch(
+        graph: Union[nx.MultiDiGraph, "PreparedGraph"], queries: Iterable[str], start_nodes: Iterable[int] = None,
+        final_nodes: Iterable[int] = None, chunk_size: int = None
+) -> Dict[str, Dict[int, Set[int]]]:
+    """
+    Calculates rpq_to_graph_bfs_all_reachable for many regular expressions at once, see rpq_to_graph_bfs_batch
+    :param graph: Graph to send queries to or PreparedGraph
+    :param queries: Regular Expressions to query
+    :param start_nodes: Set of start nodes
+    :param final_nodes: Set of final nodes
+    :param chunk_size: (optional) number of start nodes processed at once, all of them by default
+    :return: dictionary query -> Regular Path Querying in Dictionary format
+    """
+    queries = list(dict.fromkeys(queries))
+    if len(queries) == 0:
+        return dict()
+    graph_matrix = _get_graph_matrix(graph, start_nodes, final_nodes)
+    union_matrix, tags = _get_union_query_matrix(queries)
+    start_indices = graph_matrix.indices_by_states(graph_matrix.start_states)
+    nodes = graph_matrix.get_state_values()
+    result = {query: {start: set() for start in nodes[start_indices]} for query in queries}
+
+    if chunk_size is None:
+        chunk_size = max(len(start_indices), 1)
+    for i in range(0, len(start_indices), chunk_size):
+        chunk = start_indices[i:i + chunk_size]
+        visited_matrix = _multiple_source_bfs(graph_matrix, union_matrix, chunk)
+        query_ids, blocks, ends = _get_tagged_reachable_states(graph_matrix, union_matrix, tags, visited_matrix)
+        for query_id, start, end in zip(query_ids.tolist(), nodes[chunk[blocks]], nodes[ends]):
+            result[queries[query_id]][start].add(end)
+    return result
+
+
+class PreparedGraph:
+    """
+    Class representing graph with label matrices built once, so many queries can be sent to it
+    without converting the graph again. Can be passed to rpq functions instead of the graph
+    """
+    def __init__(self, graph: nx.MultiDiGraph):
+        """
+        :param graph: Graph with "label" attribute on edges or LabeledGraph
+        """
+        self.graph_matrix = AdjacencyMatrix.from_graph(graph)
+
+    def get_adjacency_matrix(self, start_nodes: Iterable = None, final_nodes: Iterable = None) -> AdjacencyMatrix:
+        """
+        Gets Adjacency Matrix of the graph with given start and final nodes sharing label matrices of the graph
+        :param start_nodes: (optional) nodes to be used as start states, all nodes by default
+        :param final_nodes: (optional) nodes to be used as final states, all nodes by default
+        :return: Adjacency Matrix equivalent to AdjacencyMatrix.from_graph(graph, start_nodes, final_nodes)
+        """
+        start_nodes = None if start_nodes is None else list(start_nodes)
+        final_nodes = None if final_nodes is None else list(final_nodes)
+        result = copy.copy(self.graph_matrix)
+        extra_states = [
+            State(node) for node in (*(start_nodes or ()), *(final_nodes or ()))
+            if State(node) not in result.state_indices
+        ]
+        if len(extra_states) != 0:
+            result.state_indices = dict(result.state_indices)
+            result.add_states(extra_states)
+        if start_nodes is not None:
+            result.start_states = {State(node) for node in start_nodes}
+        if final_nodes is not None:
+            result.final_states = {State(node) for node in final_nodes}
+        return result
+
+
+def rpq_shortest_paths(
+        graph: Union[nx.MultiDiGraph, "PreparedGraph"], query: str, start_nodes: Iterable[int] = None,
+        final_nodes: Iterable[int] = None
+) -> "RPQPaths":
+    """
+    Calculates rpq_to_graph_bfs_all_reachable keeping BFS levels, so a shortest witness path
+    can be reconstructed for every answer. Levels are kept only by this function, other ones do not pay for them
+    :param graph: Graph to send query to or PreparedGraph
+    :param query: Regular Expression to query
+    :param start_nodes: Set of start nodes
+    :param final_nodes: Set of final nodes
+    :return: RPQPaths
+    """
+    graph_matrix = _get_graph_matrix(graph, start_nodes, final_nodes)
+    query_matrix = regex_util.compile_regex(query).matrix
+    start_indices = graph_matrix.indices_by_states(graph_matrix.start_states)
 
-    nfa = regex_util.graph_to_nfa(graph, start_nodes, final_nodes)
-    dfa = regex_util.regex_string_to_min_dfa(query)
-    graph_matrix = AdjacencyMatrix(nfa)
-    query_matrix = AdjacencyMatrix(dfa)
     symbols = graph_matrix.matrix.keys().__and__(query_matrix.matrix.keys())
-    front = (
-        sparse.vstack(
-            [_get_front(graph_matrix, query_matrix, {i}) for i in map(lambda state: graph_matrix.index_by_state(state), graph_matrix.start_states)]
-        )
-    )
+    operators = _get_transition_operators(query_matrix, symbols, len(start_indices))
+    front = _get_front(graph_matrix, query_matrix, start_indices)
     visited_matrix = front
+    levels = sparse.csr_matrix(front, dtype=np.int16)
+    level = 1
 
-    while True:
+    while front.nnz != 0:
         new_front = sparse.csr_matrix(front.shape, dtype=bool)
-        for label in symbols:
-            new_front_cut = front.__matmul__(graph_matrix.matrix[label])
-            for index in range(len(graph_matrix.start_states)):
-                for (i, j) in zip(*query_matrix.matrix[label].nonzero()):
-                    new_front[index * query_matrix.get_states_len() + j, :] += \
-                        new_front_cut[index * query_matrix.get_states_len() + i, :]
+        for label, operator in operators.items():
+            new_front += operator @ (front @ graph_matrix.matrix[label])
 
         front = new_front > visited_matrix
-        visited_matrix += front
+        visited_matrix = visited_matrix + front
+        level += 1
+        if level > np.iinfo(levels.dtype).max:
+            levels = levels.astype(np.int32)
+        levels = levels + sparse.csr_matrix(front, dtype=levels.dtype) * level
 
-        if front.count_nonzero() == 0:
-            break
+    return RPQPaths(graph_matrix, query_matrix, start_indices, levels)
+
+
+class RPQPaths:
+    """
+    Class representing answer of Regular Path Query with BFS levels of all visited product states:
+    levels matrix has the block layout of _multiple_source_bfs, entry is 1 + length of the shortest path
+    from the block start node to the product state, 0 for unvisited states
+    """
+    def __init__(
+            self, graph_matrix: AdjacencyMatrix, query_matrix: AdjacencyMatrix, start_indices: np.ndarray,
+            levels: sparse.csr_matrix
+    ):
+        self.graph_matrix = graph_matrix
+        self.query_matrix = query_matrix
+        self.start_indices = start_indices
+        self.levels = levels
+        self._blocks = {index: block for block, index in enumerate(start_indices.tolist())}
+        self._query_final_indices = query_matrix.indices_by_states(query_matrix.final_states)
+        self._transposed = None
+        self._levels_by_columns = None
 
-    result = {
-        graph_matrix.state_by_index(start_state_idx):
-            _get_reachable_states(graph_matrix, query_matrix, sub_front_idx, visited_matrix)
-            for sub_front_idx, start_state_idx in enumerate(
-                map(lambda state: graph_matrix.index_by_state(state), graph_matrix.start_states)
+    def get_pairs(self, sparse_result: bool = False) -> Union[Set[Tuple], NodePairs]:
+        """
+        :param sparse_result: return NodePairs backed by sparse matrix instead of Python set
+        :return: pairs (start, end) of all answers, same as in rpq_to_graph_bfs_all_reachable
+        """
+        blocks, ends = _get_reachable_states(self.graph_matrix, self.query_matrix, self.levels)
+        result = NodePairs.from_index_arrays(
+            self.start_indices[blocks], ends, self.graph_matrix.get_state_values()
+        )
+        return result if sparse_result else result.to_set()
+
+    def get_length(self, start, end) -> Union[int, None]:
+        """
+        :param start: Start node
+        :param end: Final node
+        :return: length of the shortest path matching the query, None if end is not an answer for start
+        """
+        found = self._get_final_state(start, end)
+        return None if found is None else found[1] - 1
+
+    def get_path(self, start, end) -> Union[List[Tuple], None]:
+        """
+        Reconstructs the shortest path by going back along states with decreasing levels
+        :param start: Start node
+        :param end: Final node
+        :return: edges (node_from, node_to, label) of the shortest path matching the query,
+        None if end is not an answer for start
+        """
+        found = self._get_final_state(start, end)
+        if found is None:
+            return None
+        row, level = found
+        block_offset = row - row % self.query_matrix.get_states_len()
+        query_index, graph_index = row - block_offset, self.graph_matrix.index_by_state(State(end))
+        if self._transposed is None:
+            self._transposed = {
+                symbol: (self.graph_matrix.matrix[symbol].T.tocsr(), self.query_matrix.matrix[symbol].T.tocsr())
+                for symbol in self.graph_matrix.matrix.keys().__and__(self.query_matrix.matrix.keys())
+            }
+
+        nodes = self.graph_matrix.get_state_values()
+        path = []
+        while level > 1:
+            level, query_index, graph_index, edge = next(
+                (level - 1, query_from, graph_from, (nodes[graph_from], nodes[graph_index], symbol.value))
+                for symbol, (graph_transposed, query_transposed) in self._transposed.items()
+                for query_from in _get_row_indices(query_transposed, query_index)
+                for graph_from in _get_row_indices(graph_transposed, graph_index)
+                if self._get_level(block_offset + query_from, graph_from) == level - 1
             )
-        }
+            path.append(edge)
+        return path[::-1]
 
-    return {start.value: {end.value for end in ends} for (start, ends) in result.items()}
+    def _get_final_state(self, start, end) -> Union[Tuple[int, int], None]:
+        """
+        Helper function to find final product state of the shortest path from start to end
+        :return: row of the state in levels and its level
+        """
+        if State(start) not in self.graph_matrix.state_indices or State(end) not in self.graph_matrix.final_states:
+            return None
+        block = self._blocks.get(self.graph_matrix.index_by_state(State(start)))
+        if block is None:
+            return None
+        rows = block * self.query_matrix.get_states_len() + self._query_final_indices
+        column = self.graph_matrix.index_by_state(State(end))
+        found = [(row, self._get_level(row, column)) for row in rows.tolist()]
+        return min((pair for pair in found if pair[1] != 0), key=lambda pair: pair[1], default=None)
 
+    def _get_level(self, row: int, column: int) -> int:
+        """
+        Helper function to get level of a product state from csc copy of levels built once,
+        so lookups cost a binary search within one column
+        """
+        if self._levels_by_columns is None:
+            self._levels_by_columns = self.levels.tocsc()
+            self._levels_by_columns.sort_indices()
+        levels = self._levels_by_columns
+        start, end = levels.indptr[column], levels.indptr[column + 1]
+        position = start + np.searchsorted(levels.indices[start:end], row)
+        return int(levels.data[position]) if position < end and levels.indices[position] == row else 0
+
+
+class IncrementalRPQ:
+    """
+    Class maintaining answer of Regular Path Query under batches of edge insertions and deletions.
+    Keeps graph label matrices, product adjacency of graph and query DFA with multiplicities of product edges,
+    and transitive closure of the product graph, so the answer is the same as rpq_to_graph_tc on the current graph.
+    Insertions resume the semi-naive closure from the added product edges only. Deletions recompute closure rows
+    of product states that could reach a removed product edge, reusing closure rows of all other states
+    """
+    def __init__(self, graph: nx.MultiDiGraph, query: str, start_nodes: set = None, final_nodes: set = None):
+        """
+        :param graph: Initial graph
+        :param query: Regular Expression to query
+        :param start_nodes: Set of start nodes, all nodes of the current graph by default
+        :param final_nodes: Set of final nodes, all nodes of the current graph by default
+        """
+        self.graph_matrix = AdjacencyMatrix.from_graph(graph)
+        self.query_matrix = regex_util.compile_regex(query).matrix
+        self.start_nodes = start_nodes
+        self.final_nodes = final_nodes
 
+        size = self._get_product_len()
+        self.adjacency = sparse.csr_matrix((size, size), dtype=np.int32)
+        for symbol, matrix in self.graph_matrix.matrix.items():
+            self.adjacency = self.adjacency + self._get_product_edges(symbol, matrix)
+        self.closure = transitive_closure(self.adjacency)
 
+    def insert_edges(self, edges: Iterable[Tuple]):
+        """
+        Adds edges to the graph and updates the answer
+        :param edges: Edges (node_from, node_to, label), new nodes are added to the graph
+        :return: None
+        """
+        edge_matrices = self.graph_matrix.get_edge_matrices(edges)
+        self._resize()
+
+        added = sparse.csr_matrix(self.adjacency.shape, dtype=np.int32)
+        for symbol, matrix in edge_matrices.items():
+            graph_matrix = self.graph_matrix.matrix.get(symbol)
+            if graph_matrix is not None:
+                matrix = matrix > graph_matrix
+                self.graph_matrix.matrix[symbol] = graph_matrix + matrix
+            else:
+                self.graph_matrix.matrix[symbol] = matrix
+            added = added + self._get_product_edges(symbol, matrix)
+
+        self.adjacency = self.adjacency + added
+        self.closure = transitive_closure(added, closed=self.closure)
+
+    def delete_edges(self, edges: Iterable[Tuple]):
+        """
+        Removes edges from the graph and updates the answer. Graph is treated as a set of labeled edges,
+        so all parallel edges with the same label are removed at once
+        :param edges: Edges (node_from, node_to, label), unknown edges are ignored
+        :return: None
+        """
+        edge_matrices = self.graph_matrix.get_edge_matrices(edges, add_states=False)
+
+        removed = sparse.csr_matrix(self.adjacency.shape, dtype=np.int32)
+        for symbol, matrix in edge_matrices.items():
+            graph_matrix = self.graph_matrix.matrix.get(symbol)
+            if graph_matrix is None:
+                continue
+            matrix = graph_matrix.multiply(matrix).tocsr()
+            self.graph_matrix.matrix[symbol] = graph_matrix > matrix
+            removed = removed + self._get_product_edges(symbol, matrix)
+
+        self.adjacency = self.adjacency - removed
+        self.adjacency.eliminate_zeros()
+        gone = sparse.csr_matrix(removed, dtype=bool) > sparse.csr_matrix(self.adjacency, dtype=bool)
+        if gone.nnz == 0:
+            return
+
+        sources = np.zeros(self.closure.shape[0], dtype=bool)
+        sources[gone.nonzero()[0]] = True
+        affected = sources | (self.closure @ sources.astype(np.int32) != 0)
+        affected_indices = np.flatnonzero(affected)
+
+        adjacency = sparse.csr_matrix(self.adjacency, dtype=bool)
+        affected_adjacency = adjacency[affected_indices]
+        kept = sparse.diags(~affected, dtype=bool, format="csr")
+        rows = affected_adjacency + affected_adjacency @ kept @ self.closure
+        inner_closure = transitive_closure(affected_adjacency[:, affected_indices])
+        rows = rows + inner_closure @ rows
+
+        selection = sparse.csr_matrix(
+            (np.ones(len(affected_indices), dtype=bool), (affected_indices, np.arange(len(affected_indices)))),
+            shape=(self.closure.shape[0], len(affected_indices)),
+        )
+        self.closure = kept @ self.closure + selection @ rows
+
+    def get_result(self, sparse_result: bool = False) -> Union[Set[Tuple], NodePairs]:
+        """
+        :param sparse_result: return NodePairs backed by sparse matrix instead of Python set
+        :return: Regular Path Query answer on the current graph, same as rpq_to_graph_tc
+        """
+        query_length = self.query_matrix.get_states_len()
+        start_indices = np.unique(_product_indices(
+            self._get_node_indices(self.start_nodes),
+            self.query_matrix.indices_by_states(self.query_matrix.start_states),
+            self.query_matrix,
+        ))
+        final_indices = np.unique(_product_indices(
+            self._get_node_indices(self.final_nodes),
+            self.query_matrix.indices_by_states(self.query_matrix.final_states),
+            self.query_matrix,
+        ))
+        rows, cols = self.closure[start_indices][:, final_indices].nonzero()
+        result = NodePairs.from_index_arrays(
+            start_indices[rows] // query_length, final_indices[cols] // query_length,
+            self.graph_matrix.get_state_values(),
+        )
+        return result if sparse_result else result.to_set()
+
+    def get_reachable(self) -> Set:
+        """
+        :return: final nodes reachable from any start node on the current graph
+        """
+        _, final_nodes = self.get_result(sparse_result=True).get_node_arrays()
+        return set(final_nodes.tolist())
+
+    def _get_node_indices(self, nodes: Iterable = None) -> np.ndarray:
+        """
+        Helper function to get indices of given nodes present in the graph, all nodes by default
+        """
+        if nodes is None:
+            return np.arange(self.graph_matrix.get_states_len())
+        return self.graph_matrix.indices_by_states(
+            State(node) for node in nodes if State(node) in self.graph_matrix.state_indices
+        )
+
+    def _get_product_len(self) -> int:
+        return self.graph_matrix.get_states_len() * self.query_matrix.get_states_len()
+
+    def _get_product_edges(self, symbol, graph_matrix: sparse.spmatrix) -> sparse.csr_matrix:
+        """
+        Helper function to get product edges of graph edges with given label, entries count query transitions
+        """
+        size = self._get_product_len()
+        query_matrix = self.query_matrix.matrix.get(symbol)
+        if query_matrix is None:
+            return sparse.csr_matrix((size, size), dtype=np.int32)
+        return sparse.kron(graph_matrix.astype(np.int32), query_matrix.astype(np.int32), format="csr")
+
+    def _resize(self):
+        """
+        Helper function to grow product matrices after new graph nodes are added,
+        product indices of new nodes follow the existing ones
+        """
+        size = self._get_product_len()
+        if size != self.closure.shape[0]:
+            self.adjacency = resize_matrix(self.adjacency, size)
+            self.closure = resize_matrix(self.closure, size)
+
+
+def _iterate_chunks(
+        graph_matrix: AdjacencyMatrix, query: str, chunk_size: int = None, workers: int = None
+) -> Iterator[Tuple[np.ndarray, Tuple[np.ndarray, np.ndarray]]]:
+    """
+    Helper function running BFS over chunks of start states
+    :return: Iterator of chunk start indices with block numbers and reachable final indices of the chunk
+    """
+    query_matrix = regex_util.compile_regex(query).matrix
+    start_indices = graph_matrix.indices_by_states(graph_matrix.start_states)
+
+    if chunk_size is None:
+        chunk_size = max(len(start_indices), 1)
+    chunks = [start_indices[i:i + chunk_size] for i in range(0, len(start_indices), chunk_size)]
+
+    if workers is None:
+        yield from zip(chunks, (_get_chunk_reachable(graph_matrix, query_matrix, chunk) for chunk in chunks))
+        return
+
+    with ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(graph_matrix, query_matrix)
+    ) as executor:
+        yield from zip(chunks, executor.map(_get_worker_chunk_reachable, chunks))
+
+
+_worker_matrices = None
+
+
+def _init_worker(graph_matrix: AdjacencyMatrix, query_matrix: AdjacencyMatrix):
+    """
+    Helper function storing read-only matrices once per worker process instead of sending them with every chunk
+    """
+    global _worker_matrices
+    _worker_matrices = (graph_matrix, query_matrix)
+
+
+def _get_worker_chunk_reachable(start_indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Helper function processing one chunk in a worker process
+    """
+    return _get_chunk_reachable(*_worker_matrices, start_indices)
+
+
+def _get_chunk_reachable(
+        graph_matrix: AdjacencyMatrix, query_matrix: AdjacencyMatrix, start_indices: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Helper function running BFS for one chunk of start indices
+    :return: block numbers and reachable final indices as two parallel arrays
+    """
+    visited_matrix = _multiple_source_bfs(graph_matrix, query_matrix, start_indices)
+    return _get_reachable_states(graph_matrix, query_matrix, visited_matrix)
+
+
+def _multiple_source_bfs(graph_matrix: AdjacencyMatrix, query_matrix: AdjacencyMatrix, start_indices: np.ndarray):
+    """
+    Helper function running BFS from every start index at once, one front block per start index
+    :return: visited block matrix
+    """
+    symbols = graph_matrix.matrix.keys().__and__(query_matrix.matrix.keys())
+    operators = _get_transition_operators(query_matrix, symbols, len(start_indices))
+    front = _get_front(graph_matrix, query_matrix, start_indices)
+    visited_matrix = front
+
+    while front.nnz != 0:
+        new_front = sparse.csr_matrix(front.shape, dtype=bool)
+        for label, operator in operators.items():
+            new_front += operator @ (front @ graph_matrix.matrix[label])
+
+        front = new_front > visited_matrix
+        visited_matrix = visited_matrix + front
+
+    return visited_matrix
+
+
+def _get_graph_matrix(
+        graph: Union[nx.MultiDiGraph, PreparedGraph], start_nodes: Iterable = None, final_nodes: Iterable = None
+) -> AdjacencyMatrix:
+    """
+    Helper function to get Adjacency Matrix of graph, reusing label matrices of PreparedGraph
+    """
+    if isinstance(graph, PreparedGraph):
+        return graph.get_adjacency_matrix(start_nodes, final_nodes)
+    return AdjacencyMatrix.from_graph(graph, start_nodes, final_nodes)
+
+
+def _get_union_query_matrix(queries: Iterable[str]) -> Tuple[AdjacencyMatrix, np.ndarray]:
+    """
+    Helper function uniting DFAs of queries into one block diagonal Adjacency Matrix,
+    its states are (query number, DFA state value) pairs
+    :return: united Adjacency Matrix and query number of every its state
+    """
+    query_matrices = [regex_util.compile_regex(query).matrix for query in queries]
+    states, tags = [], []
+    result = AdjacencyMatrix()
+    for query_id, query_matrix in enumerate(query_matrices):
+        states.extend(State((query_id, state.value)) for state in query_matrix.index_states)
+        tags.extend([query_id] * query_matrix.get_states_len())
+        result.start_states.update(State((query_id, state.value)) for state in query_matrix.start_states)
+        result.final_states.update(State((query_id, state.value)) for state in query_matrix.final_states)
+    result.set_states(states)
+
+    symbols = set().union(*(query_matrix.matrix.keys() for query_matrix in query_matrices))
+    for symbol in symbols:
+        result.matrix[symbol] = sparse.block_diag([
+            query_matrix.matrix.get(symbol, sparse.csr_matrix(
+                (query_matrix.get_states_len(), query_matrix.get_states_len()), dtype=bool
+            ))
+            for query_matrix in query_matrices
+        ], format="csr", dtype=bool)
+    return result, np.asarray(tags, dtype=np.int64)
+
+
+def _get_tagged_reachable_states(
+        graph_matrix: AdjacencyMatrix, union_matrix: AdjacencyMatrix, tags: np.ndarray, visited
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Helper function to get reachable final indices of united queries, same as _get_reachable_states
+    but keeping the query each final state belongs to
+    :return: query numbers, block numbers and graph final state indices as three parallel arrays
+    """
+    union_length = union_matrix.get_states_len()
+    union_final_mask = np.zeros(union_length, dtype=bool)
+    union_final_mask[union_matrix.indices_by_states(union_matrix.final_states)] = True
+    graph_final_mask = np.zeros(graph_matrix.get_states_len(), dtype=bool)
+    graph_final_mask[graph_matrix.indices_by_states(graph_matrix.final_states)] = True
+
+    rows, cols = visited.nonzero()
+    accepted = union_final_mask[rows % union_length] & graph_final_mask[cols]
+    triplets = np.unique(
+        np.stack([tags[rows[accepted] % union_length], rows[accepted] // union_length, cols[accepted]])
+        .astype(np.int64),
+        axis=1,
+    )
+    return triplets[0], triplets[1], triplets[2]
+
+
+def _get_row_indices(matrix: sparse.csr_matrix, row: int) -> np.ndarray:
+    """
+    Helper function to get column indices of nonzero entries of csr matrix row
+    """
+    return matrix.indices[matrix.indptr[row]:matrix.indptr[row + 1]]
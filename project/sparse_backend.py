@@ -0,0 +1,265 @@
+from abc import ABC, abstractmethod
+from typing import NamedTuple, Tuple, Union
+
+import numpy as np
+from scipy import sparse
+
+try:
+    import graphblas
+except ImportError:
+    graphblas = None
+
+
+class SparseBackend(ABC):
+    """
+    Class representing boolean matrix operations used by reachability algorithms.
+    Matrices are backend specific objects, scipy csr matrices are converted at the boundaries only
+    """
+    name = None
+
+    @abstractmethod
+    def from_coo(self, rows: np.ndarray, cols: np.ndarray, shape: Tuple[int, int]):
+        """
+        :param rows: Row indices of true entries, duplicates are merged
+        :param cols: Column indices of true entries
+        :param shape: Matrix shape
+        :return: boolean matrix
+        """
+
+    def from_scipy(self, matrix: sparse.spmatrix):
+        """
+        :param matrix: scipy sparse matrix, nonzero entries are true
+        :return: boolean matrix
+        """
+        rows, cols = matrix.nonzero()
+        return self.from_coo(rows, cols, matrix.shape)
+
+    @abstractmethod
+    def to_scipy(self, matrix) -> sparse.csr_matrix:
+        """
+        :param matrix: boolean matrix
+        :return: boolean csr matrix
+        """
+
+    def zeros(self, shape: Tuple[int, int]):
+        return self.from_coo(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), shape)
+
+    def identity(self, size: int):
+        indices = np.arange(size)
+        return self.from_coo(indices, indices, (size, size))
+
+    @abstractmethod
+    def mxm(self, first, second, exclude=None):
+        """
+        Boolean product: entry [i, j] is true if first[i, k] and second[k, j] for some k
+        :param first: Left boolean matrix
+        :param second: Right boolean matrix
+        :param exclude: (optional) complemented mask, true entries of exclude are dropped from the product
+        :return: boolean matrix
+        """
+
+    @abstractmethod
+    def add(self, first, second):
+        """
+        :return: element-wise disjunction
+        """
+
+    @abstractmethod
+    def subtract(self, first, second):
+        """
+        :return: entries of first missing in second
+        """
+
+    @abstractmethod
+    def kron(self, first, second):
+        """
+        :return: Kronecker product
+        """
+
+    @abstractmethod
+    def nnz(self, matrix) -> int:
+        """
+        :return: number of true entries
+        """
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+
+class ScipyBackend(SparseBackend):
+    """
+    Backend over scipy csr matrices with boolean dtype
+    """
+    name = "scipy"
+
+    def from_coo(self, rows: np.ndarray, cols: np.ndarray, shape: Tuple[int, int]) -> sparse.csr_matrix:
+        return sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=shape, dtype=bool)
+
+    def from_scipy(self, matrix: sparse.spmatrix) -> sparse.csr_matrix:
+        return sparse.csr_matrix(matrix, dtype=bool, copy=True)
+
+    def to_scipy(self, matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+        return matrix
+
+    def zeros(self, shape: Tuple[int, int]) -> sparse.csr_matrix:
+        return sparse.csr_matrix(shape, dtype=bool)
+
+    def identity(self, size: int) -> sparse.csr_matrix:
+        return sparse.identity(size, dtype=bool, format="csr")
+
+    def mxm(self, first, second, exclude=None) -> sparse.csr_matrix:
+        product = first @ second
+        return product if exclude is None else product > exclude
+
+    def add(self, first, second) -> sparse.csr_matrix:
+        return first + second
+
+    def subtract(self, first, second) -> sparse.csr_matrix:
+        return first > second
+
+    def kron(self, first, second) -> sparse.csr_matrix:
+        return sparse.kron(first, second, format="csr")
+
+    def nnz(self, matrix) -> int:
+        return matrix.nnz
+
+
+class PackedBits(NamedTuple):
+    """
+    Dense boolean matrix with rows packed into bits of uint64 words
+    """
+    bits: np.ndarray
+    ncols: int
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.bits.shape[0], self.ncols
+
+
+class BitsetBackend(SparseBackend):
+    """
+    Dense backend over rows packed into bitsets, products and masks are word-wide bitwise operations.
+    Takes n * m / 8 bytes per matrix, so it suits small matrices such as query automata
+    """
+    name = "bitset"
+
+    def from_coo(self, rows: np.ndarray, cols: np.ndarray, shape: Tuple[int, int]) -> PackedBits:
+        dense = np.zeros(shape, dtype=bool)
+        dense[rows, cols] = True
+        return _pack_bits(dense)
+
+    def to_scipy(self, matrix: PackedBits) -> sparse.csr_matrix:
+        return sparse.csr_matrix(_unpack_bits(matrix), dtype=bool)
+
+    def mxm(self, first: PackedBits, second: PackedBits, exclude: PackedBits = None) -> PackedBits:
+        result = np.zeros((first.bits.shape[0], second.bits.shape[1]), dtype=np.uint64)
+        first_dense = _unpack_bits(first)
+        for middle in np.flatnonzero(first_dense.any(axis=0) & second.bits.any(axis=1)):
+            result[first_dense[:, middle]] |= second.bits[middle]
+        if exclude is not None:
+            result &= ~exclude.bits
+        return PackedBits(result, second.ncols)
+
+    def add(self, first: PackedBits, second: PackedBits) -> PackedBits:
+        return PackedBits(first.bits | second.bits, first.ncols)
+
+    def subtract(self, first: PackedBits, second: PackedBits) -> PackedBits:
+        return PackedBits(first.bits & ~second.bits, first.ncols)
+
+    def kron(self, first: PackedBits, second: PackedBits) -> PackedBits:
+        return _pack_bits(np.kron(_unpack_bits(first), _unpack_bits(second)))
+
+    def nnz(self, matrix: PackedBits) -> int:
+        return int(np.unpackbits(matrix.bits.view(np.uint8)).sum())
+
+
+class GraphBLASBackend(SparseBackend):
+    """
+    Backend over python-graphblas matrices, products run in the (or, and) semiring
+    and complemented masks are applied during multiplication
+    """
+    name = "graphblas"
+
+    def __init__(self):
+        if graphblas is None:
+            raise ImportError("graphblas backend requires python-graphblas package")
+
+    def from_coo(self, rows: np.ndarray, cols: np.ndarray, shape: Tuple[int, int]):
+        return graphblas.Matrix.from_coo(rows, cols, True, dtype=bool, nrows=shape[0], ncols=shape[1])
+
+    def from_scipy(self, matrix: sparse.spmatrix):
+        matrix = sparse.csr_matrix(matrix, dtype=bool, copy=True)
+        matrix.eliminate_zeros()
+        return graphblas.io.from_scipy_sparse(matrix)
+
+    def to_scipy(self, matrix) -> sparse.csr_matrix:
+        return sparse.csr_matrix(graphblas.io.to_scipy_sparse(matrix, format="csr"), dtype=bool)
+
+    def zeros(self, shape: Tuple[int, int]):
+        return graphblas.Matrix(bool, nrows=shape[0], ncols=shape[1])
+
+    def mxm(self, first, second, exclude=None):
+        product = first.mxm(second, graphblas.semiring.lor_land)
+        if exclude is None:
+            return product.new()
+        result = graphblas.Matrix(bool, nrows=first.nrows, ncols=second.ncols)
+        result(mask=~exclude.V) << product
+        return result
+
+    def add(self, first, second):
+        return first.ewise_add(second, graphblas.monoid.lor).new()
+
+    def subtract(self, first, second):
+        result = graphblas.Matrix(bool, nrows=first.nrows, ncols=first.ncols)
+        result(mask=~second.V) << first
+        return result
+
+    def kron(self, first, second):
+        return first.kronecker(second, graphblas.binary.land).new()
+
+    def nnz(self, matrix) -> int:
+        return matrix.nvals
+
+
+BACKENDS = {backend.name: backend for backend in (ScipyBackend, BitsetBackend, GraphBLASBackend)}
+
+
+def get_backend(backend: Union[str, SparseBackend] = None) -> SparseBackend:
+    """
+    :param backend: Backend name from BACKENDS or backend instance, scipy by default
+    :return: SparseBackend
+    """
+    if backend is None:
+        return ScipyBackend()
+    if isinstance(backend, SparseBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown sparse backend {backend!r}, expected one of {sorted(BACKENDS)}")
+    return BACKENDS[backend]()
+
+
+def available_backends() -> list:
+    """
+    :return: names of backends usable in current environment
+    """
+    return [name for name in BACKENDS if name != GraphBLASBackend.name or graphblas is not None]
+
+
+def _pack_bits(dense: np.ndarray) -> PackedBits:
+    """
+    Helper function packing rows of dense boolean matrix into uint64 words
+    """
+    packed = np.packbits(dense, axis=1, bitorder="little")
+    words = -(-packed.shape[1] // 8)
+    padded = np.zeros((dense.shape[0], words * 8), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return PackedBits(padded.view(np.uint64), dense.shape[1])
+
+
+def _unpack_bits(matrix: PackedBits) -> np.ndarray:
+    """
+    Helper function unpacking PackedBits into dense boolean matrix
+    """
+    return np.unpackbits(
+        matrix.bits.view(np.uint8), axis=1, count=matrix.ncols, bitorder="little"
+    ).astype(bool)
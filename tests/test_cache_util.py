@@ -0,0 +1,29 @@
+import tempfile
+import unittest
+
+from project.cache_util import CompilationCache
+
+
+class CacheUtilTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_lru_eviction(self):
+        cache = CompilationCache(maxsize=2)
+        assert cache.get("a", lambda: 1) == 1
+        assert cache.get("b", lambda: 2) == 2
+        assert cache.get("a", lambda: -1) == 1
+        assert cache.get("c", lambda: 3) == 3
+        assert "a" in cache and "b" not in cache and "c" in cache
+        assert (cache.hits, cache.misses) == (1, 3)
+
+    def test_disk_tier(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = CompilationCache(cache_dir=cache_dir)
+            assert cache.get(("key", 1), lambda: {"value": [1, 2]}) == {"value": [1, 2]}
+
+            cache = CompilationCache(cache_dir=cache_dir)
+            assert cache.get(("key", 1), lambda: None) == {"value": [1, 2]}
+            assert (cache.hits, cache.disk_hits, cache.misses) == (0, 1, 0)
+            assert cache.get(("key", 2), lambda: "other") == "other"
+            assert cache.misses == 1
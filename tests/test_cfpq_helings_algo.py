@@ -1,8 +1,12 @@
 import unittest
 
-from pyformlang.cfg import CFG
+import numpy as np
 
-from project.cfpq import cfpq
+from networkx import MultiDiGraph
+from pyformlang.cfg import CFG, Variable
+
+from project.cfpq import cfpq, cfpq_shortest_paths
+from project.context_free_grammar_util import GrammarIndex
 from project.g_util import build_two_cycle_labeled_graph
 
 
@@ -45,4 +49,60 @@ class CfpqHellingsAlgoTest(unittest.TestCase):
         graph = build_two_cycle_labeled_graph(1, 1, ("a", "b"))
         expected = {(0, 0), (0, 2), (1, 1), (2, 0), (2, 2)}
         actual = cfpq(graph, CFG.from_text(cfg), "hellings")
-        assert actual == expected
\ No newline at end of file
+        assert actual == expected
+
+    def test_same_as_matrix(self):
+        cfg = """
+        S -> a S b S | epsilon
+        """
+        graph = build_two_cycle_labeled_graph(3, 2, ("a", "b"))
+        expected = cfpq(graph, CFG.from_text(cfg), "matrix")
+        actual = cfpq(graph, CFG.from_text(cfg), "hellings")
+        assert actual == expected
+
+    def test_grammar_index_reuse(self):
+        index = GrammarIndex(CFG.from_text("S -> a S b S | epsilon"))
+        for first_cycle, second_cycle in [(1, 1), (2, 1), (3, 2)]:
+            graph = build_two_cycle_labeled_graph(first_cycle, second_cycle, ("a", "b"))
+            expected = cfpq(graph, CFG.from_text("S -> a S b S | epsilon"), "hellings")
+            assert cfpq(graph, index, "hellings") == expected
+            assert cfpq(graph, index, "matrix") == expected
+
+    def test_shortest_paths(self):
+        cfg = "S -> a S b | a b"
+        graph = build_two_cycle_labeled_graph(3, 2, ("a", "b"))
+        paths = cfpq_shortest_paths(graph, CFG.from_text(cfg))
+        assert paths.get_pairs() == cfpq(graph, CFG.from_text(cfg), "hellings")
+        assert paths.get_length(3, 4) == 2
+        assert paths.get_path(3, 4) == [(3, 0, "a"), (0, 4, "b")]
+        assert paths.get_length(2, 5) == 4
+        assert paths.get_path(4, 4) is None
+
+    def test_grammar_index_start_symbol(self):
+        graph = MultiDiGraph()
+        graph.add_edge(0, 1, label="a")
+        assert cfpq(graph, CFG.from_text("S -> b\nA -> a"), "hellings", start_symbol=Variable("A")) == {(0, 1)}
+        index = GrammarIndex(CFG.from_text("S -> b\nA -> a"))
+        for algo in ["hellings", "matrix", "tensor", "gll"]:
+            with self.assertRaises(ValueError):
+                cfpq(graph, index, algo, start_symbol=Variable("A"))
+
+    def test_shortest_paths_length_improvements(self):
+        cfg = "S -> S S | a | b S a"
+        graph = MultiDiGraph()
+        graph.add_nodes_from(range(4))
+        graph.add_edges_from([
+            (0, 3, {"label": "a"}), (1, 2, {"label": "b"}), (1, 1, {"label": "a"}), (1, 0, {"label": "b"}),
+            (2, 3, {"label": "b"}), (3, 1, {"label": "a"}), (3, 0, {"label": "a"}), (3, 0, {"label": "b"}),
+            (3, 2, {"label": "b"}),
+        ])
+        paths = cfpq_shortest_paths(graph, CFG.from_text(cfg))
+        assert paths.get_pairs() == cfpq(graph, CFG.from_text(cfg), "hellings")
+        assert paths.lengths.dtype == np.int16
+        for start, end in paths.get_pairs():
+            path = paths.get_path(start, end)
+            assert len(path) == paths.get_length(start, end)
+            assert CFG.from_text(cfg).contains([label for _, _, label in path])
+        assert paths.get_length(1, 0) == 3
+        assert paths.get_length(1, 3) == 4
+        assert paths.get_path(2, 2) is None
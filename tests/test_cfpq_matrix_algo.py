@@ -1,9 +1,11 @@
 import unittest
 
-from pyformlang.cfg import CFG
+from networkx import MultiDiGraph
+from pyformlang.cfg import CFG, Variable
 
-from project.cfpq import cfpq
-from project.g_util import build_two_cycle_labeled_graph
+from project.cfpq import cfpq, matrix_, matrix_reachability, IncrementalCFPQ
+from project.g_util import build_two_cycle_labeled_graph, LabeledGraph
+from project.matrix_util import IterationStatistics
 
 
 class CfpqMatrixAlgoTest(unittest.TestCase):
@@ -45,4 +47,65 @@ class CfpqMatrixAlgoTest(unittest.TestCase):
         graph = build_two_cycle_labeled_graph(1, 1, ("a", "b"))
         expected = {(0, 0), (0, 2), (1, 1), (2, 0), (2, 2)}
         actual = cfpq(graph, CFG.from_text(cfg), "matrix")
-        assert actual == expected
\ No newline at end of file
+        assert actual == expected
+
+    def test_statistics(self):
+        cfg = """
+        S -> a S b | a b
+        """
+        graph = build_two_cycle_labeled_graph(3, 2, ("a", "b"))
+        statistics = IterationStatistics()
+        triplets = matrix_(CFG.from_text(cfg), graph, statistics)
+        assert statistics.iterations == len(statistics.nnz_growth)
+        assert statistics.nnz_growth[-1] == 0
+        assert (0, Variable("S"), 0) in triplets
+
+    def test_named_nodes(self):
+        cfg = """
+        S -> a S b | a b
+        """
+        graph = MultiDiGraph()
+        graph.add_edges_from([("x", "y", {"label": "a"}), ("y", "z", {"label": "a"}),
+                              ("z", "w", {"label": "b"}), ("w", "v", {"label": "b"})])
+        expected = {("y", "w"), ("x", "v")}
+        actual = cfpq(graph, CFG.from_text(cfg), "matrix")
+        assert actual == expected
+
+    def test_reachability_matrix(self):
+        cfg = """
+        S -> a S b | a b
+        """
+        graph = build_two_cycle_labeled_graph(3, 2, ("a", "b"))
+        matrix, nodes = matrix_reachability(CFG.from_text(cfg), graph, {0, 1}, {0, 4, 5})
+        actual = {(nodes[i], nodes[j]) for i, j in zip(*matrix.nonzero())}
+        expected = cfpq(graph, CFG.from_text(cfg), "hellings", {0, 1}, {0, 4, 5})
+        assert actual == expected
+        assert matrix.nnz == len(expected)
+
+
+    def test_labeled_graph(self):
+        cfg = CFG.from_text("""
+        S -> a S b | a b
+        """)
+        graph = build_two_cycle_labeled_graph(3, 2, ("a", "b"))
+        labeled_graph = LabeledGraph.from_networkx(graph)
+        expected = cfpq(graph, cfg, "hellings")
+        for algo in ("hellings", "matrix", "tensor", "gll"):
+            assert cfpq(labeled_graph, cfg, algo) == expected
+
+    def test_incremental(self):
+        cfg = CFG.from_text("""
+        S -> a S b | a b
+        """)
+        graph = build_two_cycle_labeled_graph(3, 2, ("a", "b"))
+        incremental = IncrementalCFPQ(graph, cfg)
+        assert incremental.get_result() == cfpq(graph, cfg, "matrix")
+
+        edges = [(5, 3, "a"), (4, 6, "b"), (3, 3, "b")]
+        incremental.insert_edges(edges)
+        graph.add_edges_from((u, v, {"label": label}) for u, v, label in edges)
+        assert incremental.get_result() == cfpq(graph, cfg, "matrix")
+
+        incremental.delete_edges([(0, 1, "a"), (4, 6, "b"), (7, 8, "a")])
+        graph.remove_edges_from([(0, 1), (4, 6)])
+        assert incremental.get_result() == cfpq(graph, cfg, "matrix")
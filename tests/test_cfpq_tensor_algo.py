@@ -0,0 +1,89 @@
+import unittest
+
+from networkx import MultiDiGraph
+from pyformlang.cfg import CFG
+
+from project.cfpq import cfpq, tensor_
+from project.g_util import build_two_cycle_labeled_graph
+from project.matrix_util import IterationStatistics
+
+
+class CfpqTensorAlgoTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_1(self):
+        cfg = "S -> epsilon"
+        graph = build_two_cycle_labeled_graph(1, 1, ("a", "b"))
+        expected = {(0, 0), (1, 1), (2, 2)}
+        actual = cfpq(graph, CFG.from_text(cfg), "tensor")
+        assert actual == expected
+
+    def test_2(self):
+        cfg = """
+            S -> a S
+            S -> epsilon
+            """
+        graph = build_two_cycle_labeled_graph(1, 1, ("a", "b"))
+        expected = {(0, 0), (0, 1), (1, 0), (1, 1), (2, 2)}
+        actual = cfpq(graph, CFG.from_text(cfg), "tensor")
+        assert actual == expected
+
+    def test_3(self):
+        cfg = """
+            S -> a b
+            S -> a S1
+            S1 -> S b
+            """
+        graph = build_two_cycle_labeled_graph(2, 1, ("a", "b"))
+        expected = {(0, 0), (0, 3), (1, 0), (1, 3), (2, 0), (2, 3)}
+        actual = cfpq(graph, CFG.from_text(cfg), "tensor", {0, 1, 2, 3}, {0, 1, 2, 3})
+        assert actual == expected
+
+    def test_4(self):
+        cfg = """
+        S -> S b | epsilon
+        """
+        graph = build_two_cycle_labeled_graph(1, 1, ("a", "b"))
+        expected = {(0, 0), (0, 2), (1, 1), (2, 0), (2, 2)}
+        actual = cfpq(graph, CFG.from_text(cfg), "tensor")
+        assert actual == expected
+
+    def test_same_as_hellings(self):
+        cfg = """
+        S -> a S b S | epsilon
+        """
+        graph = build_two_cycle_labeled_graph(3, 2, ("a", "b"))
+        expected = cfpq(graph, CFG.from_text(cfg), "hellings")
+        actual = cfpq(graph, CFG.from_text(cfg), "tensor")
+        assert actual == expected
+
+    def test_statistics(self):
+        cfg = """
+        S -> a S b | a b
+        """
+        graph = build_two_cycle_labeled_graph(3, 2, ("a", "b"))
+        statistics = IterationStatistics()
+        triplets = tensor_(CFG.from_text(cfg), graph, statistics)
+        assert statistics.nnz_growth[-1] == 0
+        assert sum(statistics.nnz_growth) == len(triplets)
+
+    def test_named_nodes(self):
+        cfg = """
+        S -> a S b | a b
+        """
+        graph = MultiDiGraph()
+        graph.add_edges_from([("x", "y", {"label": "a"}), ("y", "z", {"label": "a"}),
+                              ("z", "w", {"label": "b"}), ("w", "v", {"label": "b"})])
+        expected = {("y", "w"), ("x", "v")}
+        actual = cfpq(graph, CFG.from_text(cfg), "tensor")
+        assert actual == expected
+
+
+    def test_nonterminal_labeled_edges(self):
+        graph = MultiDiGraph()
+        graph.add_edges_from([(0, 1, {"label": "A"}), (1, 2, {"label": "b"}), (2, 3, {"label": "S"})])
+        for cfg in ["S -> A b\nA -> a", "S -> a"]:
+            expected = cfpq(graph, CFG.from_text(cfg), "hellings")
+            assert expected == set()
+            assert cfpq(graph, CFG.from_text(cfg), "tensor") == expected
@@ -1,6 +1,8 @@
 from pyformlang.cfg import Production, Terminal
+from project.cache_util import CompilationCache
 from project.context_free_grammar_util import *
 import os.path
+import tempfile
 import unittest
 
 
@@ -52,3 +54,36 @@ class CFXUtilTest(unittest.TestCase):
         cfg = get_cfg_from_file(file)
         assert cfg.is_empty()
         os.remove(file)
+
+    def test_grammar_index(self):
+        cfg_text = """
+            S -> a S b | epsilon
+        """
+        index = GrammarIndex(CFG.from_text(cfg_text))
+        assert index.start_symbol == Variable("S")
+        assert index.eps_heads == {Variable("S")}
+        assert set(index.terminal_to_heads.keys()) == {"a", "b"}
+        for head, bodies in index.var_to_var_dict.items():
+            for left, right in bodies:
+                assert any(head in heads and r == right for r, heads in index.left_to_right[left])
+                assert any(head in heads and l == left for l, heads in index.right_to_left[right])
+        assert get_grammar_index(index) is index
+
+
+    def test_compile_grammar(self):
+        cfg_text = """
+            S -> a S b | a b
+        """
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = CompilationCache(cache_dir=cache_dir)
+            index = compile_grammar(cfg_text, cache=cache)
+            assert compile_grammar(cfg_text, cache=cache) is index
+            assert compile_grammar(cfg_text, Variable("A"), cache=cache) is not index
+            assert (cache.hits, cache.misses) == (1, 2)
+            assert set(index.get_rsm().boxes) == {"S"}
+
+            cache = CompilationCache(cache_dir=cache_dir)
+            loaded = compile_grammar(cfg_text, cache=cache)
+            assert cache.disk_hits == 1
+            assert loaded.eps_heads == index.eps_heads
+            assert set(loaded.get_rsm_matrix().matrix) == set(index.get_rsm_matrix().matrix)
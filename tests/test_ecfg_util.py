@@ -220,4 +220,19 @@ class ECFGUtilTest(unittest.TestCase):
         am: AdjacencyMatrix = ams[Variable("S")]
         assert am.get_states_len() == 5
         assert am.get_start_states_len() == 1
-        assert am.get_final_states_len() == 2
\ No newline at end of file
+        assert am.get_final_states_len() == 2
+
+    def test_united_am(self):
+        s = """
+        S -> a S b | A
+        A -> c | epsilon
+        """
+        ecfg = ECFG.get_ecfg_from_string(s)
+        rfa = ecfg.convert_to_RecursiveFiniteAutomata()
+        ams = rfa.get_adjacency_matrices()
+        united = rfa.get_united_adjacency_matrix()
+        assert united.get_states_len() == sum(am.get_states_len() for am in ams.values())
+        assert united.get_start_states_len() == 2
+        assert united.get_final_states_len() == sum(am.get_final_states_len() for am in ams.values())
+        assert {state.value[0] for state in united.start_states} == {Variable("S"), Variable("A")}
+
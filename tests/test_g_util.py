@@ -1,8 +1,17 @@
 import filecmp
+import gzip
 import os
+import pathlib
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import cfpq_data as cfpq
+import networkx as nx
 
 from project.g_util import *
+from project.matrix_util import AdjacencyMatrix
+from project.rpq import rpq_to_graph_tc
 
 
 class GUtilTest(unittest.TestCase):
@@ -16,6 +25,110 @@ class GUtilTest(unittest.TestCase):
 
     def test_build_2_cycles(self):
         graph = build_two_cycle_labeled_graph(42, 29, edge_labels=("A", "B"))
-        save_graph_to_file(graph, "G")
-        assert filecmp.cmp("G", "./tests/expected_2_cycles_graph.dot")
-        os.remove("G")
+        with tempfile.TemporaryDirectory() as graph_dir:
+            path = os.path.join(graph_dir, "G")
+            save_graph_to_file(graph, path)
+            assert filecmp.cmp(path, "./tests/expected_2_cycles_graph.dot")
+
+    def test_graph_cache(self):
+        graph = build_two_cycle_labeled_graph(4, 3, edge_labels=("A", "B"))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            digest = cache_graph(graph, "two_cycles", cache_dir)
+            arrays = load_graph_arrays("two_cycles", cache_dir)
+            assert set(arrays.labels.tolist()) == {"A", "B"}
+            assert len(arrays.sources) == graph.number_of_edges()
+
+            loaded = load_graph("two_cycles", cache_dir=cache_dir)
+            assert list(loaded.nodes) == list(graph.nodes)
+            assert sorted(loaded.edges(data="label")) == sorted(graph.edges(data="label"))
+            assert cache_graph(loaded, "same_content", cache_dir) == digest
+
+    def test_graph_cache_keeps_node_types(self):
+        graph = build_two_cycle_labeled_graph(4, 3, edge_labels=("A", "B"))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache_graph(LabeledGraph.from_networkx(graph), "labeled", cache_dir)
+            assert load_labeled_graph("labeled", cache_dir).node_ids.tolist() == list(graph.nodes)
+            named_graph = nx.relabel_nodes(graph, str)
+            cache_graph(LabeledGraph.from_networkx(named_graph), "named", cache_dir)
+            assert load_labeled_graph("named", cache_dir).node_ids.tolist() == list(named_graph.nodes)
+
+            path = os.path.join(cache_dir, "graph.csv")
+            with open(path, "w") as file:
+                file.write("0 x a\n")
+            with self.assertRaises(ValueError):
+                cache_graph(read_edge_list(path), "mixed", cache_dir)
+
+    def test_labeled_graph_value_types(self):
+        tuple_graph = nx.MultiDiGraph()
+        tuple_graph.add_edges_from([((0, 1), (1, 2), {"label": "a"}), ((1, 2), (0, 1), {"label": "b"})])
+        mixed_graph = nx.MultiDiGraph()
+        mixed_graph.add_edges_from([(1, "x", {"label": "a"}), ("x", 2, {"label": "b"})])
+        label_graph = nx.MultiDiGraph()
+        label_graph.add_edges_from([(0, 1, {"label": 5}), (1, 2, {}), (2, 3, {"label": "c"})])
+        for graph in (tuple_graph, mixed_graph, label_graph):
+            labeled_graph = LabeledGraph.from_networkx(graph)
+            assert list(labeled_graph.nodes) == list(graph.nodes)
+            assert list(labeled_graph.edges(data="label")) == list(graph.edges(data="label"))
+            labeled_symbols = set(AdjacencyMatrix.from_graph(labeled_graph).matrix)
+            assert labeled_symbols == set(AdjacencyMatrix.from_graph(graph).matrix)
+        assert rpq_to_graph_tc(LabeledGraph.from_networkx(mixed_graph), "a b", {1}) == {(1, 2)}
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for graph in (tuple_graph, mixed_graph, label_graph):
+                with self.assertRaises(ValueError):
+                    cache_graph(graph, "graph", cache_dir)
+
+    def test_graph_cache_concurrent_writers(self):
+        graph = build_two_cycle_labeled_graph(4, 3, edge_labels=("A", "B"))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                digests = set(executor.map(lambda _: cache_graph(graph, "two.cycles", cache_dir), range(32)))
+            assert len(digests) == 1
+            names_dir = pathlib.Path(cache_dir) / "names" / cfpq.__version__
+            assert [file.name for file in names_dir.iterdir()] == ["two.cycles"]
+            assert len(load_graph_arrays("two.cycles", cache_dir).sources) == graph.number_of_edges()
+
+    def test_labeled_graph(self):
+        graph = build_two_cycle_labeled_graph(4, 3, edge_labels=("A", "B"))
+        labeled_graph = LabeledGraph.from_networkx(graph)
+        assert list(labeled_graph.nodes) == list(graph.nodes)
+        assert labeled_graph.number_of_edges() == graph.number_of_edges()
+        assert sorted(labeled_graph.edges(data="label")) == sorted(graph.edges(data="label"))
+        assert sorted(labeled_graph.out_edges(0, data="label")) == sorted(graph.out_edges(0, data="label"))
+        assert labeled_graph.has_node(7) and not labeled_graph.has_node(8)
+        assert get_graph_information(labeled_graph) == get_graph_information(graph)
+        assert {label: matrix.nnz for label, matrix in labeled_graph.get_label_matrices().items()} == {"A": 5, "B": 4}
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            path = os.path.join(cache_dir, "graph.csv")
+            with open(path, "w") as file:
+                file.write("0 1 a\n1 2 b\n5 0 a\n")
+            csv_graph = LabeledGraph.from_csv(path)
+            assert list(csv_graph.nodes) == [0, 1, 2, 5]
+            assert list(csv_graph.edges(data="label")) == [(0, 1, "a"), (1, 2, "b"), (5, 0, "a")]
+
+            cache_graph(csv_graph, "csv_graph", cache_dir)
+            loaded = load_labeled_graph("csv_graph", cache_dir)
+            assert list(loaded.edges(data="label")) == list(csv_graph.edges(data="label"))
+
+    def test_read_edge_list(self):
+        with tempfile.TemporaryDirectory() as graph_dir:
+            path = os.path.join(graph_dir, "graph.csv")
+            lines = "".join(f"{i} {(i * 7) % 11} {'ab'[i % 2]}\n" for i in range(30))
+            with open(path, "w") as file:
+                file.write(lines)
+            with gzip.open(path + ".gz", "wt") as file:
+                file.write(lines)
+
+            expected = cfpq.graph_from_csv(path)
+            for graph in (read_edge_list(path), read_edge_list(path + ".gz", chunk_size=4)):
+                assert list(graph.nodes) == list(expected.nodes)
+                assert sorted(graph.edges(data="label")) == sorted(expected.edges(data="label"))
+                assert {label: matrix.nnz for label, matrix in graph.get_label_matrices().items()} == {"a": 15, "b": 15}
+            assert sorted(load_graph(path).edges(data="label")) == sorted(expected.edges(data="label"))
+
+            with open(path, "w") as file:
+                file.write("0 1 a\n1 2 5\n")
+            expected = cfpq.graph_from_csv(path)
+            assert list(read_edge_list(path).edges(data="label")) == list(expected.edges(data="label"))
+            assert list(read_edge_list(path).edges(data="label")) == [(0, 1, "a"), (1, 2, "5")]
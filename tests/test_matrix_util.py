@@ -1,11 +1,15 @@
 import unittest
 
+from networkx import MultiDiGraph
+
 from project import g_util, regex_util
 from project.matrix_util import *
 
-from pyformlang.finite_automaton import (NondeterministicFiniteAutomaton, State)
+from pyformlang.finite_automaton import (NondeterministicFiniteAutomaton, State, Symbol)
 
-from project.rpq import rpq_to_graph_tc, rpq_to_graph_bfs_all_reachable, rpq_to_graph_bfs
+from project.rpq import rpq_to_graph_tc, rpq_to_graph_bfs_all_reachable, rpq_to_graph_bfs, \
+    rpq_to_graph_bfs_all_reachable_chunks, IncrementalRPQ, PreparedGraph, rpq_to_graph_bfs_batch, \
+    rpq_to_graph_bfs_all_reachable_batch, rpq_path_exists, rpq_shortest_paths
 
 
 class MatrixUtilTest(unittest.TestCase):
@@ -19,6 +23,65 @@ class MatrixUtilTest(unittest.TestCase):
         tc = am.get_transitive_closure()
         assert tc.sum() == tc.size
 
+    def test_create_matrix(self):
+        nfa = NondeterministicFiniteAutomaton()
+        nfa.add_transitions([(0, "A", 1), (0, "A", 2), (1, "B", 2), (2, "A", 0)])
+        am = AdjacencyMatrix(nfa)
+        assert am.matrix[Symbol("A")].nnz == 3
+        assert am.matrix[Symbol("B")].nnz == 1
+        assert am.matrix[Symbol("A")][am.index_by_state(State(0)), am.index_by_state(State(2))]
+
+    def test_from_graph(self):
+        graph = g_util.build_two_cycle_labeled_graph(4, 3, ("A", "B"))
+        expected = AdjacencyMatrix(regex_util.graph_to_nfa(graph, {0}, {1, 2}))
+        actual = AdjacencyMatrix.from_graph(graph, {0}, {1, 2})
+
+        assert actual.start_states == expected.start_states
+        assert actual.final_states == expected.final_states
+        assert actual.matrix.keys() == expected.matrix.keys()
+        for label, matrix in expected.matrix.items():
+            expected_edges = {
+                (expected.state_by_index(i), expected.state_by_index(j)) for i, j in zip(*matrix.nonzero())
+            }
+            actual_edges = {
+                (actual.state_by_index(i), actual.state_by_index(j)) for i, j in zip(*actual.matrix[label].nonzero())
+            }
+            assert actual_edges == expected_edges
+
+    def test_state_index_lookup(self):
+        nfa = NondeterministicFiniteAutomaton()
+        nfa.add_transitions([(0, "A", 1), (1, "B", 2), (2, "A", 0)])
+        am = AdjacencyMatrix(nfa)
+        for state in am.get_states():
+            assert am.state_by_index(am.index_by_state(state)) == state
+
+        indices = am.indices_by_states([State(2), State(0)])
+        assert list(am.states_by_indices(indices)) == [State(2), State(0)]
+
+    def test_intersection_state_lookup(self):
+        am1 = AdjacencyMatrix(regex_util.regex_string_to_min_dfa("A B*"))
+        am2 = AdjacencyMatrix(regex_util.regex_string_to_min_dfa("A B"))
+        intersected = intersect_adjacency_matrices(am1, am2)
+        assert intersected.get_states_len() == am1.get_states_len() * am2.get_states_len()
+        for index in range(intersected.get_states_len()):
+            assert intersected.index_by_state(intersected.state_by_index(index)) == index
+
+    def test_transitive_closure_statistics(self):
+        nfa = NondeterministicFiniteAutomaton()
+        nfa.add_transitions([(i, "A", i + 1) for i in range(8)])
+        am = AdjacencyMatrix(nfa)
+        statistics = IterationStatistics()
+        tc = am.get_transitive_closure(statistics)
+        assert tc.dtype == bool
+        assert tc.nnz == 9 * 8 // 2
+        assert statistics.iterations == len(statistics.nnz_growth)
+        assert statistics.nnz_growth[-1] == 0
+        assert sum(statistics.nnz_growth) == tc.nnz - 8
+
+    def test_transitive_closure_without_transitions(self):
+        am = AdjacencyMatrix(regex_util.regex_string_to_min_dfa("$"))
+        assert am.get_transitive_closure().nnz == 0
+
     def test_intersection_1(self):
         fa1 = NondeterministicFiniteAutomaton()
         fa1.add_transitions([(0, "A", 1), (0, "B", 0), (1, "C", 1), (1, "D", 2), (2, "E", 0)])
@@ -57,6 +120,35 @@ class MatrixUtilTest(unittest.TestCase):
         actual = adjacency_matrix_to_nfa(intersected)
         assert expected.is_equivalent_to(actual)
 
+    def test_lazy_intersection_reachable(self):
+        graph = g_util.build_two_cycle_labeled_graph(4, 3, ("A", "B"))
+        am1 = AdjacencyMatrix.from_graph(graph, {0, 5}, {1, 2, 3})
+        am2 = AdjacencyMatrix(regex_util.regex_string_to_min_dfa("A* B"))
+        lazy = intersect_adjacency_matrices_lazy(am1, am2)
+        materialized = intersect_adjacency_matrices(am1, am2)
+
+        assert set(lazy.start_indices.tolist()) == materialized.start_states
+        assert set(lazy.final_indices.tolist()) == materialized.final_states
+
+        tc = materialized.get_transitive_closure()
+        expected = set(materialized.start_states)
+        for start in materialized.start_states:
+            expected.update(tc[start].nonzero()[1].tolist())
+        actual = lazy.front_to_indices(lazy.get_reachable())
+        assert set(actual.tolist()) == expected
+
+    def test_lazy_intersection_step(self):
+        am1 = AdjacencyMatrix(regex_util.regex_string_to_min_dfa("A B C"))
+        am2 = AdjacencyMatrix(regex_util.regex_string_to_min_dfa("A B*"))
+        lazy = intersect_adjacency_matrices_lazy(am1, am2)
+        materialized = lazy.to_adjacency_matrix()
+        step_matrix = sum(materialized.matrix.values())
+
+        for index in range(lazy.get_states_len()):
+            front = lazy.get_front([index])
+            expected = step_matrix[index].nonzero()[1]
+            assert list(lazy.front_to_indices(lazy.step(front))) == sorted(expected)
+
     def test_rpq_tc(self):
         regex = "AAAAAA | B"
         start_nodes = {0}
@@ -83,6 +175,19 @@ class MatrixUtilTest(unittest.TestCase):
         expected = {(1, 0)}
         assert expected == actual
 
+    def test_rpq_tc_named_nodes(self):
+        graph = MultiDiGraph()
+        graph.add_edges_from([("x", "y", {"label": "A"}), ("y", "z", {"label": "B"}), ("z", "x", {"label": "A"})])
+
+        actual = rpq_to_graph_tc(graph, "A B", {"x", "z"}, {"z"})
+        assert actual == {("x", "z")}
+
+        actual = rpq_to_graph_tc(graph, "(A B)*", {"y"})
+        assert actual == set()
+
+        actual = rpq_to_graph_tc(graph, "(A | B)*", {"z"}, {"x", "z"})
+        assert actual == {("z", "x"), ("z", "z")}
+
     # seEfficiencyWarning: Changing the sparsity structure of a csr_matrix is expensive. lil_matrix is more efficient.
     def test_rpq_bfs(self):
         regex = "AAAAAA | B"
@@ -138,3 +243,90 @@ class MatrixUtilTest(unittest.TestCase):
         actual = rpq_to_graph_bfs(graph, regex, start_nodes, final_nodes)
         expected = {0}
         assert expected == actual
+
+    def test_rpq_bfs_all_reachable_distinct_starts(self):
+        regex = "A A"
+        graph = g_util.build_two_cycle_labeled_graph(3, 2, edge_labels=("A", "B"))
+
+        start_nodes = {0, 1, 2, 3}
+        actual = rpq_to_graph_bfs_all_reachable(graph, regex, start_nodes)
+        expected = {0: {2}, 1: {3}, 2: {0}, 3: {1}}
+        assert expected == actual
+
+        actual = rpq_to_graph_bfs(graph, regex, start_nodes)
+        expected = {0, 1, 2, 3}
+        assert expected == actual
+
+    def test_rpq_bfs_all_reachable_chunks(self):
+        regex = "A A"
+        graph = g_util.build_two_cycle_labeled_graph(3, 2, edge_labels=("A", "B"))
+        start_nodes = {0, 1, 2, 3}
+        expected = {0: {2}, 1: {3}, 2: {0}, 3: {1}}
+
+        chunks = list(rpq_to_graph_bfs_all_reachable_chunks(graph, regex, start_nodes, chunk_size=3))
+        assert [len(chunk) for chunk in chunks] == [3, 1]
+        assert expected == {start: ends for chunk in chunks for start, ends in chunk.items()}
+
+        actual = rpq_to_graph_bfs_all_reachable(graph, regex, start_nodes, chunk_size=2, workers=2)
+        assert expected == actual
+
+    def test_rpq_one_shot_iterables(self):
+        graph = g_util.build_two_cycle_labeled_graph(3, 2, edge_labels=("A", "B"))
+        assert rpq_to_graph_bfs(graph, "A", iter([0]), iter([1])) == {1}
+        assert rpq_to_graph_bfs_all_reachable(graph, "A", (node for node in [0])) == \
+            rpq_to_graph_bfs_all_reachable(graph, "A", [0])
+
+    def test_rpq_labeled_graph(self):
+        regex = "A* B"
+        graph = g_util.build_two_cycle_labeled_graph(3, 2, edge_labels=("A", "B"))
+        labeled_graph = g_util.LabeledGraph.from_networkx(graph)
+
+        assert rpq_to_graph_tc(labeled_graph, regex) == rpq_to_graph_tc(graph, regex)
+        assert rpq_to_graph_tc(labeled_graph, regex, {0}, {4, 7}) == rpq_to_graph_tc(graph, regex, {0}, {4, 7})
+        assert rpq_to_graph_bfs_all_reachable(labeled_graph, regex) == rpq_to_graph_bfs_all_reachable(graph, regex)
+
+    def test_incremental_rpq(self):
+        regex = "A* B"
+        graph = g_util.build_two_cycle_labeled_graph(3, 2, edge_labels=("A", "B"))
+        incremental = IncrementalRPQ(graph, regex, start_nodes={0, 1})
+        assert incremental.get_result() == rpq_to_graph_tc(graph, regex, {0, 1})
+
+        edges = [(5, 1, "A"), (3, 6, "B"), (0, 1, "C")]
+        incremental.insert_edges(edges)
+        graph.add_edges_from((u, v, {"label": label}) for u, v, label in edges)
+        assert incremental.get_result() == rpq_to_graph_tc(graph, regex, {0, 1})
+
+        edges = [(0, 1, "A"), (3, 6, "B"), (7, 8, "A")]
+        incremental.delete_edges(edges)
+        graph.remove_edges_from([(0, 1), (3, 6)])
+        assert incremental.get_result() == rpq_to_graph_tc(graph, regex, {0, 1})
+        assert incremental.get_reachable() == {v for _, v in rpq_to_graph_tc(graph, regex, {0, 1})}
+
+    def test_rpq_batch(self):
+        queries = ["A A", "A* B", "B", "C"]
+        graph = g_util.build_two_cycle_labeled_graph(3, 2, edge_labels=("A", "B"))
+        prepared_graph = PreparedGraph(graph)
+
+        actual = rpq_to_graph_bfs_batch(prepared_graph, queries, {0, 1})
+        assert actual == {query: rpq_to_graph_bfs(graph, query, {0, 1}) for query in queries}
+        actual = rpq_to_graph_bfs_all_reachable_batch(prepared_graph, queries, {0, 1}, {0, 2, 4}, chunk_size=1)
+        assert actual == {query: rpq_to_graph_bfs_all_reachable(graph, query, {0, 1}, {0, 2, 4}) for query in queries}
+        assert rpq_to_graph_tc(prepared_graph, "A* B", {0, 9}) == rpq_to_graph_tc(graph, "A* B", {0, 9})
+        assert rpq_to_graph_bfs(prepared_graph, "A", iter([0]), iter([1])) == {1}
+
+    def test_rpq_path_exists(self):
+        graph = g_util.build_two_cycle_labeled_graph(3, 2, edge_labels=("A", "B"))
+        for regex, start_nodes, final_nodes in [
+            ("A A", {1}, {3}), ("A A", {1}, {2}), ("A* B", {0}, {5}), ("B B B", {0}, {0}), ("C*", {7}, {7}),
+        ]:
+            expected = len(rpq_to_graph_bfs(graph, regex, start_nodes, final_nodes)) != 0
+            assert rpq_path_exists(graph, regex, start_nodes, final_nodes) == expected
+            assert rpq_path_exists(graph, regex, start_nodes, final_nodes, bidirectional=False) == expected
+
+    def test_rpq_shortest_paths(self):
+        graph = g_util.build_two_cycle_labeled_graph(3, 2, edge_labels=("A", "B"))
+        paths = rpq_shortest_paths(graph, "A* B", {0, 1}, {4, 5})
+        assert {end for _, end in paths.get_pairs()} == rpq_to_graph_bfs(graph, "A* B", {0, 1}, {4, 5})
+        assert paths.get_length(1, 4) == 4
+        assert paths.get_path(1, 4) == [(1, 2, "A"), (2, 3, "A"), (3, 0, "A"), (0, 4, "B")]
+        assert paths.get_path(1, 3) is None
@@ -1,3 +1,5 @@
+import os
+import tempfile
 import unittest
 import io
 
@@ -68,6 +70,15 @@ class qLangInterpreter(unittest.TestCase):
         expected = graph_to_nfa(load_graph("wc"))
         assert actual.value == expected
 
+    def test_load_edge_list(self):
+        with tempfile.TemporaryDirectory() as graph_dir:
+            path = os.path.join(graph_dir, "graph.csv")
+            with open(path, "w") as file:
+                file.write("0 1 a\n1 2 b\n2 0 a\n")
+            actual = i(parse(f"load(\"{path}\");", "expr"))
+            expected = graph_to_nfa(load_graph(path))
+        assert actual.value == expected
+
     def test_get_start(self):
         actual = i(parse("getStart(\"a\");", "expr"))
         expected = {"0"}
@@ -2,7 +2,8 @@ import unittest
 from networkx import MultiDiGraph, MultiGraph
 
 from project.g_util import build_two_cycle_labeled_graph, read_graph_from_file
-from project.regex_util import regex_string_to_min_dfa, graph_to_nfa
+from project.cache_util import CompilationCache
+from project.regex_util import regex_string_to_min_dfa, graph_to_nfa, compile_regex
 from pyformlang.finite_automaton import Symbol, State, DeterministicFiniteAutomaton, NondeterministicFiniteAutomaton
 
 
@@ -88,6 +89,19 @@ class RegexUtilDFATest(unittest.TestCase):
         assert all(dfa.accepts(word) for word in accepted)
         assert not all(dfa.accepts(word) for word in not_accepted)
 
+    def test_compile_regex_cache(self):
+        cache = CompilationCache(maxsize=4)
+        compiled = compile_regex("a b*", cache)
+        assert compile_regex("  a   b* ", cache) is compiled
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert compiled.text == "a b*"
+        assert compiled.dfa.accepts([Symbol("a"), Symbol("b")])
+        assert set(compiled.matrix.matrix) == {Symbol("a"), Symbol("b")}
+
+        dfa = regex_string_to_min_dfa("a b*")
+        dfa.add_final_state(State("new"))
+        assert State("new") not in regex_string_to_min_dfa("a b*").final_states
+
 
 class RegexUtilNFATest(unittest.TestCase):
     def setUp(self):
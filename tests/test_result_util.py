@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+from pyformlang.cfg import CFG
+
+from project import g_util
+from project.cfpq import cfpq
+from project.result_util import NodePairs
+from project.rpq import rpq_to_graph_tc, rpq_to_graph_bfs_all_reachable
+
+
+class ResultUtilTest(unittest.TestCase):
+    def setUp(self):
+        pass
+
+    def test_node_pairs(self):
+        nodes = np.array(["x", "y", "z"], dtype=object)
+        pairs = NodePairs.from_index_arrays(np.array([0, 2, 0]), np.array([1, 1, 1]), nodes)
+        assert len(pairs) == 2
+        assert ("x", "y") in pairs
+        assert ("z", "y") in pairs
+        assert ("y", "x") not in pairs
+        assert ("w", "x") not in pairs
+        assert list(pairs) == [("x", "y"), ("z", "y")]
+        assert pairs == {("x", "y"), ("z", "y")}
+        assert pairs.to_set() == {("x", "y"), ("z", "y")}
+
+        sources, targets = pairs.get_index_arrays()
+        assert sources.dtype == np.int64 and targets.dtype == np.int64
+        assert NodePairs.from_pairs(pairs, nodes) == pairs
+
+    def test_empty_node_pairs(self):
+        pairs = NodePairs.from_pairs(set(), np.array([0, 1], dtype=object))
+        assert len(pairs) == 0
+        assert pairs == set()
+
+    def test_rpq_sparse_result(self):
+        graph = g_util.build_two_cycle_labeled_graph(3, 2, edge_labels=("A", "B"))
+        expected = rpq_to_graph_tc(graph, "A A", {0, 1, 2})
+        actual = rpq_to_graph_tc(graph, "A A", {0, 1, 2}, sparse_result=True)
+        assert isinstance(actual, NodePairs)
+        assert actual == expected
+
+        actual = rpq_to_graph_bfs_all_reachable(graph, "A A", {0, 1, 2}, sparse_result=True)
+        assert actual == {(0, 2), (1, 3), (2, 0)}
+
+    def test_cfpq_sparse_result(self):
+        cfg = CFG.from_text("S -> a S b | a b")
+        graph = g_util.build_two_cycle_labeled_graph(3, 2, ("a", "b"))
+        for algo in ["hellings", "matrix", "tensor", "gll"]:
+            actual = cfpq(graph, cfg, algo, sparse_result=True)
+            assert isinstance(actual, NodePairs)
+            assert actual == cfpq(graph, cfg, algo)
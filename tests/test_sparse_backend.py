@@ -0,0 +1,58 @@
+import unittest
+
+import numpy as np
+from pyformlang.cfg import CFG
+from scipy import sparse
+
+from project.cfpq import cfpq
+from project.g_util import build_two_cycle_labeled_graph
+from project.matrix_util import transitive_closure
+from project.rpq import rpq_to_graph_tc
+from project.sparse_backend import get_backend, available_backends, BitsetBackend, SparseBackend
+
+
+class SparseBackendTest(unittest.TestCase):
+    def setUp(self):
+        random_state = np.random.default_rng(7)
+        self.first = sparse.random(40, 70, density=0.05, format="csr", random_state=random_state).astype(bool)
+        self.second = sparse.random(70, 65, density=0.05, format="csr", random_state=random_state).astype(bool)
+        self.mask = sparse.random(40, 65, density=0.3, format="csr", random_state=random_state).astype(bool)
+
+    def assert_equal(self, actual: sparse.spmatrix, expected: sparse.spmatrix):
+        assert actual.shape == expected.shape
+        assert (sparse.csr_matrix(actual, dtype=bool) != sparse.csr_matrix(expected, dtype=bool)).nnz == 0
+
+    def test_operations(self):
+        product = self.first @ self.second
+        for name in available_backends():
+            backend = get_backend(name)
+            first, second = backend.from_scipy(self.first), backend.from_scipy(self.second)
+            mask = backend.from_scipy(self.mask)
+            self.assert_equal(backend.to_scipy(backend.mxm(first, second)), product)
+            self.assert_equal(backend.to_scipy(backend.mxm(first, second, exclude=mask)), product > self.mask)
+            self.assert_equal(backend.to_scipy(backend.add(backend.mxm(first, second), mask)), product + self.mask)
+            self.assert_equal(backend.to_scipy(backend.subtract(mask, backend.mxm(first, second))), self.mask > product)
+            self.assert_equal(backend.to_scipy(backend.kron(first, mask)), sparse.kron(self.first, self.mask))
+            self.assert_equal(backend.to_scipy(backend.identity(5)), sparse.identity(5, dtype=bool))
+            assert backend.nnz(mask) == self.mask.nnz
+            assert backend.nnz(backend.zeros((3, 4))) == 0
+
+    def test_get_backend(self):
+        assert get_backend().name == "scipy"
+        backend = BitsetBackend()
+        assert get_backend(backend) is backend
+        with self.assertRaises(ValueError):
+            get_backend("dense")
+
+    def test_algorithms(self):
+        graph = build_two_cycle_labeled_graph(3, 2, ("a", "b"))
+        matrix = self.first[:, :40] + self.mask[:, :40]
+        for name in available_backends():
+            self.assert_equal(transitive_closure(matrix, backend=name), transitive_closure(matrix))
+            assert rpq_to_graph_tc(graph, "a* b", backend=name) == rpq_to_graph_tc(graph, "a* b")
+            assert cfpq(graph, CFG.from_text("S -> a S b | a b"), "matrix", backend=name) == \
+                cfpq(graph, CFG.from_text("S -> a S b | a b"), "matrix")
+
+    def test_abstract_backend(self):
+        with self.assertRaises(TypeError):
+            SparseBackend()